@@ -0,0 +1,23 @@
+from rest_framework.pagination import CursorPagination
+
+
+class IdCursorPagination(CursorPagination):
+    """
+    Cursor pagination on the primary key, newest first. Pages are found
+    with an indexed WHERE id < cursor instead of an OFFSET and nothing is
+    counted, so every page costs the same and rows created mid-walk
+    don't shift later pages.
+    """
+    ordering = '-id'
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
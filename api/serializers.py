@@ -5,10 +5,13 @@ from auctions.models import Bid, Claim, Vote
 
 
 class UserSerializer(serializers.HyperlinkedModelSerializer):
+    stripe_pending = serializers.BooleanField(read_only=True)
+
     class Meta:
         model = User
-        fields = ('id', 'username', 'stripe_account_token', 'stripe_cc_token')
-        read_only_fields = ('id', 'username')
+        fields = ('id', 'username', 'stripe_account_token', 'stripe_cc_token',
+                  'stripe_pending', 'stripe_error')
+        read_only_fields = ('id', 'username', 'stripe_error')
 
 
 class BidSerializer(serializers.ModelSerializer):
@@ -23,6 +26,19 @@ class BidSerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)
 
 
+class BulkBidSerializer(serializers.Serializer):
+    """
+    One item of a bulk bid request. Fields left out keep their current
+    value, or 0 for a new bid.
+    """
+    url = serializers.URLField(
+        max_length=Bid._meta.get_field('url').max_length)
+    ask = serializers.DecimalField(max_digits=6, decimal_places=2,
+                                   min_value=0, required=False)
+    offer = serializers.DecimalField(max_digits=6, decimal_places=2,
+                                     min_value=0, required=False)
+
+
 class ClaimSerializer(serializers.ModelSerializer):
     user = serializers.PrimaryKeyRelatedField(
         read_only=True,
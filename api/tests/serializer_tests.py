@@ -18,10 +18,20 @@ class UserSerializerTest(TestCase):
         self.assertEqual(self.serializer.Meta.model, User)
         self.assertEqual(
             self.serializer.Meta.fields,
-            ('id', 'username', 'stripe_account_token', 'stripe_cc_token')
+            ('id', 'username', 'stripe_account_token', 'stripe_cc_token',
+             'stripe_pending', 'stripe_error')
         )
         self.assertEqual(
-            self.serializer.Meta.read_only_fields, ('id', 'username'))
+            self.serializer.Meta.read_only_fields,
+            ('id', 'username', 'stripe_error'))
+
+    def test_reports_pending_customer(self):
+        user = User(username='user1', stripe_cc_token='tok_1')
+        self.assertTrue(
+            serializers.UserSerializer(user).data['stripe_pending'])
+        user.stripe_cc_token = ''
+        self.assertFalse(
+            serializers.UserSerializer(user).data['stripe_pending'])
 
 
 class BidSerializerTest(TestCase):
@@ -1,14 +1,19 @@
+import json
+
 import fudge
 
 from django.conf import settings
+from django.db import connection
 from django.db.models.query import QuerySet
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from model_mommy import mommy
 
 from codesy.base.models import User
 from auctions import models
 
 from .. import serializers, views
+from ..pagination import IdCursorPagination
 
 
 class UserViewSetTest(TestCase):
@@ -122,3 +127,101 @@ class VoteViewSetTest(TestCase):
         self.assertEqual(self.viewset.queryset.model, models.Vote)
         self.assertEqual(
             self.viewset.serializer_class, serializers.VoteSerializer)
+
+
+class CursorPaginationTest(TestCase):
+    def setUp(self):
+        self.user = mommy.make(settings.AUTH_USER_MODEL)
+        self.bids = [mommy.make('auctions.Bid', user=self.user,
+                                url='http://gh.com/project/%s' % i)
+                     for i in range(25)]
+        mommy.make('auctions.Bid', url='http://gh.com/other')
+        self.client.force_login(self.user)
+
+    def get_page(self, url, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(200, response.status_code)
+        for query in queries:
+            self.assertNotIn('COUNT(', query['sql'])
+        return response.data
+
+    def test_walks_all_bids_newest_first(self):
+        ids = []
+        page = self.get_page('/bids/', page_size=10)
+        while True:
+            ids += [bid['id'] for bid in page['results']]
+            if not page['next']:
+                break
+            page = self.get_page(page['next'])
+        self.assertEqual([bid.id for bid in reversed(self.bids)], ids)
+
+    def test_new_bids_do_not_shift_pages(self):
+        first = self.get_page('/bids/', page_size=10)
+        mommy.make('auctions.Bid', user=self.user, url='http://gh.com/new')
+        second = self.get_page(first['next'])
+        self.assertEqual(first['results'][-1]['id'] - 1,
+                         second['results'][0]['id'])
+
+    def test_page_size_is_capped(self):
+        self.assertEqual(10, len(self.get_page('/bids/')['results']))
+        with fudge.patched_context(IdCursorPagination, 'max_page_size', 20):
+            page = self.get_page('/bids/', page_size=1000)
+        self.assertEqual(20, len(page['results']))
+
+
+class BulkBidTest(TestCase):
+    def setUp(self):
+        self.user = mommy.make(settings.AUTH_USER_MODEL)
+        self.client.force_login(self.user)
+        self.bid = mommy.make('auctions.Bid', user=self.user,
+                              url='http://gh.com/project/1', ask=10,
+                              offer=5)
+
+    def post(self, items):
+        return self.client.post('/bids/bulk/', json.dumps(items),
+                                content_type='application/json')
+
+    def test_creates_and_updates_bids(self):
+        response = self.post([
+            {'url': 'http://gh.com/project/1', 'offer': '20'},
+            {'url': 'http://gh.com/project/2', 'ask': '30'},
+        ])
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(
+            [(self.bid.id, False, '10.00', '20.00'),
+             (models.Bid.objects.get(url='http://gh.com/project/2').id,
+              True, '30.00', '0.00')],
+            [(item['id'], item['created'], item['ask'], item['offer'])
+             for item in response.data])
+        self.assertEqual(2, models.Bid.objects.filter(user=self.user)
+                                              .count())
+
+    def test_invalid_items_apply_nothing(self):
+        response = self.post([
+            {'url': 'http://gh.com/project/1', 'offer': '20'},
+            {'url': 'not a url', 'offer': '-1'},
+        ])
+        self.assertEqual(400, response.status_code)
+        self.assertEqual({}, response.data[0])
+        self.assertEqual(['url', 'offer'], sorted(response.data[1],
+                                                  reverse=True))
+        self.assertEqual(5, models.Bid.objects.get(pk=self.bid.pk).offer)
+
+    def test_rejects_urls_too_long_for_a_bid(self):
+        url = 'http://gh.com/project/%s' % ('1' * 200)
+        response = self.post([{'url': url, 'offer': '20'}])
+        self.assertEqual(400, response.status_code)
+        self.assertEqual(['url'], list(response.data[0]))
+        self.assertFalse(models.Bid.objects.filter(url=url).exists())
+
+    def test_rejects_non_list_and_oversize_bodies(self):
+        response = self.post({'url': 'http://gh.com/project/1'})
+        self.assertEqual(400, response.status_code)
+        with fudge.patched_context(views.BidViewSet, 'max_bulk_bids', 1):
+            response = self.post([{'url': 'http://gh.com/project/2'},
+                                  {'url': 'http://gh.com/project/3'}])
+        self.assertEqual(400, response.status_code)
+        self.assertFalse(models.Bid.objects.filter(
+            url__in=['http://gh.com/project/2',
+                     'http://gh.com/project/3']).exists())
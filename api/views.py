@@ -1,9 +1,14 @@
+from rest_framework import status
+from rest_framework.decorators import list_route
+from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet
 
 from auctions.models import Bid, Claim, Vote
+from auctions.utils import save_bids
 from codesy.base.models import User
-from .serializers import (BidSerializer, ClaimSerializer, UserSerializer,
-                          VoteSerializer)
+from .pagination import IdCursorPagination
+from .serializers import (BidSerializer, BulkBidSerializer, ClaimSerializer,
+                          UserSerializer, VoteSerializer)
 
 
 class UserViewSet(ModelViewSet):
@@ -24,7 +29,10 @@ class AutoOwnObjectsModelViewSet(ModelViewSet):
     Custom ModelViewSet that automatically:
         1. assigns obj.user to self.request.user
         2. restricts queryset to users' own objects
+        3. pages lists with an id cursor
     """
+    pagination_class = IdCursorPagination
+
     def pre_save(self, obj):
         obj.user = self.request.user
 
@@ -38,6 +46,30 @@ class BidViewSet(AutoOwnObjectsModelViewSet):
     """
     queryset = Bid.objects.all()
     serializer_class = BidSerializer
+    max_bulk_bids = 100
+
+    @list_route(methods=['post'])
+    def bulk(self, request):
+        """
+        Create or update the user's bids from a list of {url, ask, offer},
+        all in one transaction. Responds with a result per item: the bid
+        and whether it was created, or the item's errors.
+        """
+        if not isinstance(request.data, list):
+            return Response({'detail': "Expected a list of bids."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if len(request.data) > self.max_bulk_bids:
+            return Response(
+                {'detail': "At most %s bids at a time." % self.max_bulk_bids},
+                status=status.HTTP_400_BAD_REQUEST)
+        items = BulkBidSerializer(data=request.data, many=True)
+        if not items.is_valid():
+            return Response(items.errors, status=status.HTTP_400_BAD_REQUEST)
+        results = [
+            dict(BidSerializer(bid).data, created=created)
+            for bid, created in save_bids(request.user, items.validated_data)
+        ]
+        return Response(results)
 
 
 class ClaimViewSet(AutoOwnObjectsModelViewSet):
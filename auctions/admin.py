@@ -1,6 +1,8 @@
 from django.contrib import admin
 
-from .models import Bid, Issue, Claim, Vote, Offer, Payout, OfferFee, PayoutFee
+from .models import (Bid, Issue, Claim, Vote, Offer, Payout, OfferFee,
+                     OfferPaymentJob, OfferTotal, PageTitle, PayoutFee,
+                     TitleFetchJob)
 
 admin.site.register(Bid)
 admin.site.register(Issue)
@@ -10,3 +12,7 @@ admin.site.register(Offer)
 admin.site.register(Payout)
 admin.site.register(OfferFee)
 admin.site.register(PayoutFee)
+admin.site.register(OfferTotal)
+admin.site.register(OfferPaymentJob)
+admin.site.register(TitleFetchJob)
+admin.site.register(PageTitle)
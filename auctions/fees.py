@@ -0,0 +1,49 @@
+"""
+Fee schedules for offers and payouts.
+
+Plain Decimal arithmetic with no queries, so Offer.request and
+Payout.request can price a payment before writing anything.
+"""
+from collections import namedtuple
+from decimal import Decimal, ROUND_UP
+
+CODESY_PCT = Decimal('0.025')
+STRIPE_PCT = Decimal('0.029')
+STRIPE_TRANSACTION = Decimal('0.30')
+PAYPAL_PAYOUT_FEE = Decimal('0.25')
+
+# fees: [(fee_type, amount)], each amount rounded up to the penny
+FeeSchedule = namedtuple('FeeSchedule', ['fees', 'charge_amount'])
+
+
+def roundup_penny(amount):
+    return Decimal(amount).quantize(Decimal('.01'), rounding=ROUND_UP)
+
+
+def offer_fees(amount):
+    """
+    Fees on an offer, and the amount to charge the offerer's card.
+    """
+    amount = Decimal(amount)
+    codesy_fee = roundup_penny(amount * CODESY_PCT)
+    # gross up so the charge still covers amount + codesy fee after Stripe
+    stripe_charge = ((amount + codesy_fee + STRIPE_TRANSACTION) /
+                     (1 - STRIPE_PCT))
+    stripe_fee = roundup_penny(stripe_charge - (amount + codesy_fee))
+    return FeeSchedule(
+        fees=[('codesy', codesy_fee), ('Stripe', stripe_fee)],
+        charge_amount=amount + codesy_fee + stripe_fee,
+    )
+
+
+def payout_fees(amount):
+    """
+    Fees on a payout, and the amount left to send the claimant.
+    """
+    amount = Decimal(amount)
+    paypal_fee = roundup_penny(PAYPAL_PAYOUT_FEE)
+    codesy_fee = roundup_penny(amount * CODESY_PCT)
+    return FeeSchedule(
+        fees=[('PayPal', paypal_fee), ('codesy', codesy_fee)],
+        charge_amount=amount - paypal_fee - codesy_fee,
+    )
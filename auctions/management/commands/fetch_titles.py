@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from auctions.utils import fetch_titles
+
+
+class Command(BaseCommand):
+    help = "Fetch page titles queued by Bid, Issue and Claim saves."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=None,
+                            help="Maximum number of jobs to process.")
+        parser.add_argument('--loop', type=float, default=None,
+                            metavar='SECONDS',
+                            help="Keep running, sleeping SECONDS between "
+                                 "passes.")
+
+    def handle(self, *args, **options):
+        while True:
+            saved = fetch_titles(limit=options['limit'])
+            self.stdout.write("Saved %s titles" % saved)
+            if not options['loop']:
+                break
+            time.sleep(options['loop'])
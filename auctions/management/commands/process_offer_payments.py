@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from auctions.utils import process_offer_payments
+
+
+class Command(BaseCommand):
+    help = "Charge offers queued by the bid widget."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=None,
+                            help="Maximum number of jobs to process.")
+        parser.add_argument('--loop', type=float, default=None,
+                            metavar='SECONDS',
+                            help="Keep running, sleeping SECONDS between "
+                                 "passes.")
+
+    def handle(self, *args, **options):
+        while True:
+            charged = process_offer_payments(limit=options['limit'])
+            self.stdout.write("Charged %s offers" % charged)
+            if not options['loop']:
+                break
+            time.sleep(options['loop'])
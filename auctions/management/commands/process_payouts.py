@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from auctions.payouts import poll_payout_batches, send_payout_batches
+
+
+class Command(BaseCommand):
+    help = ("Send queued payouts to PayPal in batches and record the "
+            "results of earlier batches.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help="Maximum payouts per PayPal batch.")
+        parser.add_argument('--loop', type=float, default=None,
+                            metavar='SECONDS',
+                            help="Keep running, sleeping SECONDS between "
+                                 "passes.")
+
+    def handle(self, *args, **options):
+        kwargs = {}
+        if options['batch_size']:
+            kwargs['batch_size'] = options['batch_size']
+        while True:
+            sent = send_payout_batches(**kwargs)
+            paid, failed = poll_payout_batches()
+            self.stdout.write("Sent %s batches; %s payouts paid, %s failed"
+                              % (sent, paid, failed))
+            if not options['loop']:
+                break
+            time.sleep(options['loop'])
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from auctions.models import OfferTotal
+
+
+class Command(BaseCommand):
+    help = "Recompute the denormalized offer totals from all bids."
+
+    def handle(self, *args, **options):
+        OfferTotal.rebuild()
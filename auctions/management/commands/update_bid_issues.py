@@ -1,9 +1,26 @@
 from django.core.management.base import BaseCommand
 
-from auctions.utils import update_bid_issues, update_issue_states
+from auctions.utils import (ISSUE_STATE_WORKERS, update_bid_issues,
+                            update_issue_states)
 
 
 class Command(BaseCommand):
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int,
+                            default=ISSUE_STATE_WORKERS,
+                            help="Concurrent GitHub issue lookups.")
+        parser.add_argument('--budget', type=int, default=None,
+                            help="Maximum issue lookups for this run.")
+        parser.add_argument('--by-repo', action='store_true', default=False,
+                            help="Sync states from one issue listing per "
+                                 "repository instead of per-issue lookups.")
+
     def handle(self, *args, **options):
-        update_bid_issues()
-        update_issue_states()
+        update_bid_issues(stdout=self.stdout)
+        refresher = update_issue_states(workers=options['workers'],
+                                        budget=options['budget'],
+                                        by_repo=options['by_repo'],
+                                        stdout=self.stdout)
+        self.stdout.write(
+            "Issue states: %s not modified (304), %s fetched, %s failed" %
+            (refresher.not_modified, refresher.modified, refresher.failed))
@@ -1,6 +1,19 @@
 from django.db import models
 
 
+class BidManager(models.Manager):
+    def with_offer_totals(self):
+        """
+        Annotate each bid with the OfferTotal for its url as offer_total,
+        so ask_met needs no query of its own.
+        """
+        return super(BidManager, self).get_queryset().extra(select={
+            'offer_total': 'SELECT auctions_offertotal.offer '
+                           'FROM auctions_offertotal '
+                           'WHERE auctions_offertotal.url = auctions_bid.url'
+        })
+
+
 class ClaimManager(models.Manager):
     def voted_on_by_user(self, user):
         return super(ClaimManager, self).get_queryset().filter(
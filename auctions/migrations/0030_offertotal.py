@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2026-10-17 18:15
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def populate_offer_totals(apps, schema_editor):
+    Bid = apps.get_model('auctions', 'Bid')
+    OfferTotal = apps.get_model('auctions', 'OfferTotal')
+    sums = Bid.objects.values('url').annotate(offer=Sum('offer'))
+    OfferTotal.objects.bulk_create(
+        OfferTotal(url=row['url'], offer=row['offer'] or 0) for row in sums
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0029_auto_20160519_0304'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OfferTotal',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.URLField(db_index=True, unique=True)),
+                ('offer', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='bid',
+            name='url',
+            field=models.URLField(db_index=True),
+        ),
+        migrations.RunPython(populate_offer_totals,
+                             migrations.RunPython.noop),
+    ]
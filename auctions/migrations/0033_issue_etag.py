@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2026-10-17 18:22
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0032_pagetitle'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='issue',
+            name='etag',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='issue',
+            name='last_modified',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2026-10-17 18:28
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def count_claim_votes(apps, schema_editor):
+    Bid = apps.get_model('auctions', 'Bid')
+    Claim = apps.get_model('auctions', 'Claim')
+    Vote = apps.get_model('auctions', 'Vote')
+    for claim in Claim.objects.all():
+        votes = Vote.objects.filter(claim=claim).exclude(user=claim.user_id)
+        Claim.objects.filter(id=claim.id).update(
+            eligible_voters=(Bid.objects.filter(issue=claim.issue_id)
+                                        .exclude(user=claim.user_id)
+                                        .filter(offer__gt=0).count()),
+            approvals=votes.filter(approved=True).count(),
+            rejections=votes.filter(approved=False).count(),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0033_issue_etag'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='claim',
+            name='approvals',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='claim',
+            name='eligible_voters',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='claim',
+            name='rejections',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_claim_votes, migrations.RunPython.noop),
+    ]
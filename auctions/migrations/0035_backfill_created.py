@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db.models import F
+from django.utils import timezone
+
+
+def backfill_created(apps, schema_editor):
+    for name in ('Bid', 'Claim', 'Vote', 'Offer', 'Payout'):
+        model = apps.get_model('auctions', name)
+        missing = model.objects.filter(created=None)
+        missing.exclude(modified=None).update(created=F('modified'))
+        missing.update(created=timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0034_claim_tally'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_created, migrations.RunPython.noop),
+    ]
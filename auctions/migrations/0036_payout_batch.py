@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2026-10-17 18:36
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0035_backfill_created'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payout',
+            name='batch_id',
+            field=models.CharField(blank=True, db_index=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='payout',
+            name='sender_batch_id',
+            field=models.CharField(blank=True, db_index=True, max_length=30),
+        ),
+    ]
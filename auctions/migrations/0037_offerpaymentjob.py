@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2026-10-17 18:39
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0036_payout_batch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OfferPaymentJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bid_offer', models.DecimalField(decimal_places=2, max_digits=6)),
+                ('created', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('offer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='payment_job', to='auctions.Offer')),
+            ],
+        ),
+    ]
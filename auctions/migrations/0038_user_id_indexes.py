@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2026-10-17 18:50
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0037_offerpaymentjob'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='bid',
+            index_together=set([('user', 'id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='claim',
+            index_together=set([('user', 'id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='vote',
+            index_together=set([('user', 'id')]),
+        ),
+    ]
@@ -1,24 +1,27 @@
 import uuid
-import requests
-import re
-import HTMLParser
 import stripe
 import paypalrestsdk
-from paypalrestsdk import Payout as PaypalPayout
 
-from datetime import datetime, timedelta
+from hashlib import sha1
+
+from datetime import timedelta
 from django.conf import settings
 from django.contrib.sites.models import Site
 from django.core.urlresolvers import reverse
-from django.db import models
-from django.db.models import Sum
-from django.db.models.signals import post_save, pre_save
+from django.db import models, transaction
+from django.db.models import F, Sum
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
+from django.utils import timezone
 
-from decimal import Decimal, ROUND_UP
+from decimal import Decimal
 from mailer import send_mail
 
-from .managers import ClaimManager
+from codesy import invalidation
+from codesy.mail import send_mass_mail
+
+from . import fees
+from .managers import BidManager, ClaimManager
 
 stripe.api_key = settings.STRIPE_SECRET_KEY
 
@@ -37,9 +40,17 @@ def uuid_please():
     return str(full_uuid)[:25]
 
 
+def market_tag(url):
+    """
+    Cache tag for everything about the market on url: its bids, issue,
+    claims and votes.
+    """
+    return 'url:%s' % sha1(url.encode('utf-8')).hexdigest()
+
+
 class Bid(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL)
-    url = models.URLField()
+    url = models.URLField(db_index=True)
     title = models.CharField(max_length=255, null=True, blank=True)
     issue = models.ForeignKey('Issue', null=True)
     ask = models.DecimalField(max_digits=6, decimal_places=2, blank=True,
@@ -50,27 +61,77 @@ class Bid(models.Model):
     created = models.DateTimeField(null=True, blank=True)
     modified = models.DateTimeField(null=True, blank=True, auto_now=True)
 
+    objects = BidManager()
+
     class Meta:
         unique_together = (("user", "url"),)
+        # the API pages a user's rows by id
+        index_together = (("user", "id"),)
 
     def __unicode__(self):
         return u'%s bid on %s' % (self.user, self.url)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        bid = super(Bid, cls).from_db(db, field_names, values)
+        # remember the stored url so a save that moves the bid can tidy up
+        # after the url it left; skipped when url was deferred
+        bid._stored_url = bid.__dict__.get('url')
+        return bid
+
+    def moved_from(self):
+        """
+        The stored url when this bid is being moved to a new one, else None.
+        """
+        stored_url = getattr(self, '_stored_url', None)
+        if stored_url and stored_url != self.url:
+            return stored_url
+        return None
+
+    def cache_tags(self):
+        tags = [market_tag(self.url), 'user:%s' % self.user_id]
+        if self.moved_from():
+            tags.append(market_tag(self.moved_from()))
+        return tags
+
+    def save(self, *args, **kwargs):
+        # keep the OfferTotal for this url in the same transaction as the bid
+        with transaction.atomic():
+            super(Bid, self).save(*args, **kwargs)
+        self._stored_url = self.url
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            super(Bid, self).delete(*args, **kwargs)
+
+    def _offer_total(self):
+        """
+        Sum of every offer on this bid's url, or None when there is none.
+        """
+        if hasattr(self, 'offer_total'):
+            # annotated by Bid.objects.with_offer_totals()
+            if self.offer_total is None:
+                return None
+            return Decimal(str(self.offer_total))
+        try:
+            return OfferTotal.objects.get(url=self.url).offer
+        except OfferTotal.DoesNotExist:
+            return None
+
+    def _ask_covered_by(self, offer_total):
+        if not self.ask or offer_total is None:
+            return False
+        return offer_total - Decimal(self.offer) >= Decimal(self.ask)
+
     def ask_met(self):
         if self.ask:
-            other_bids = Bid.objects.filter(
-                url=self.url
-            ).exclude(
-                user=self.user
-            ).aggregate(
-                Sum('offer')
-            )
-            return other_bids['offer__sum'] >= self.ask
+            return self._ask_covered_by(self._offer_total())
         else:
             return False
 
     def offers(self):
-        return Offer.objects.filter(bid=self)
+        # related manager, so prefetch_related('payments') is used
+        return self.payments.all()
 
     def make_offer(self, offer_amount):
         if not offer_amount:
@@ -102,20 +163,24 @@ class Bid(models.Model):
         Returns claims for this bid on which the user can take some action:
             * own_claim: they may request payout
             * other_claims: they may vote
-        """
-        try:
-            own_claim = self.claim_for_user(user)
-        except Claim.DoesNotExist:
-            own_claim = None
 
-        other_claims = self.claims_for_other_users(user)
+        Reads issue.claim_set.all(), so a prefetch_related('issue__claim_set')
+        on the bids answers it without a query.
+        """
+        own_claim = None
+        other_claims = []
+        if self.issue_id:
+            for claim in self.issue.claim_set.all():
+                if claim.user_id == user.id:
+                    own_claim = claim
+                else:
+                    other_claims.append(claim)
         return {'own_claim': own_claim, 'other_claims': other_claims}
 
-    def is_biddable_by(self, user):
+    def _biddable(self, user, ask_met, actionable_claims):
         nobid_claim_statuses = ['Submitted', 'Pending', 'Approved', 'Paid']
-        if user == self.user and self.ask_met():
+        if user.id == self.user_id and ask_met:
             return False
-        actionable_claims = self.actionable_claims(user)
         own_claim = actionable_claims['own_claim']
         if own_claim and own_claim.status == 'Rejected':
             return True
@@ -126,9 +191,87 @@ class Bid(models.Model):
                 return False
         return True
 
+    def is_biddable_by(self, user):
+        return self._biddable(user, self.ask_met(),
+                              self.actionable_claims(user))
+
+    def widget_state(self, user):
+        """
+        Everything the widget and bid list show about this bid to user.
+
+        Computed once per bid instance and user, so the template tags can
+        all read it without repeating queries.
+        """
+        if not hasattr(self, '_widget_states'):
+            self._widget_states = {}
+        if user.id not in self._widget_states:
+            offer_total = self._offer_total()
+            ask_met = self._ask_covered_by(offer_total)
+            actionable_claims = self.actionable_claims(user)
+            self._widget_states[user.id] = {
+                'offer_total': offer_total,
+                'ask_met': ask_met,
+                'actionable_claims': actionable_claims,
+                'own_claim': actionable_claims['own_claim'],
+                'other_claims': actionable_claims['other_claims'],
+                'biddable': self._biddable(user, ask_met, actionable_claims),
+            }
+        return self._widget_states[user.id]
+
+
+class OfferTotal(models.Model):
+    """
+    Denormalized sum of Bid.offer for every bid on a url, so ask_met is a
+    single row lookup. Kept current by update_offer_total and rebuilt with
+    the rebuild_offer_totals command.
+    """
+    url = models.URLField(unique=True, db_index=True)
+    offer = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    def __unicode__(self):
+        return u'Offers of %s for %s' % (self.offer, self.url)
+
+    @classmethod
+    def refresh(cls, url):
+        with transaction.atomic():
+            # lock the row so concurrent bids on the url sum in turn
+            total, created = cls.objects.select_for_update().get_or_create(
+                url=url)
+            offers = Bid.objects.filter(url=url).aggregate(Sum('offer'))
+            total.offer = offers['offer__sum'] or 0
+            total.save(update_fields=['offer'])
+
+    @classmethod
+    def rebuild(cls):
+        """
+        Recompute every total from the Bid table.
+        """
+        sums = Bid.objects.values('url').annotate(offer=Sum('offer'))
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create(
+                cls(url=row['url'], offer=row['offer'] or 0) for row in sums
+            )
+
+
+@receiver(post_save, sender=Bid)
+@receiver(post_delete, sender=Bid)
+def update_offer_total(sender, instance, **kwargs):
+    # runs first so the other Bid receivers see the new total
+    OfferTotal.refresh(instance.url)
+    if instance.moved_from():
+        OfferTotal.refresh(instance.moved_from())
+
 
 @receiver(post_save, sender=Bid)
 def notify_matching_askers(sender, instance, **kwargs):
+    notify_met_asks(instance.url)
+
+
+def notify_met_asks(url):
+    """
+    Email the askers on url whose asks the other offers now cover.
+    """
     # TODO: make a nicer HTML email template
     ASKER_NOTIFICATION_EMAIL_STRING = """
     Bidders have met your asking price for {url}.
@@ -136,32 +279,44 @@ def notify_matching_askers(sender, instance, **kwargs):
     {url}
     """
 
-    unnotified_asks = Bid.objects.filter(
-        url=instance.url, ask_match_sent=None).exclude(ask__lte=0)
-
-    for bid in unnotified_asks:
-        if bid.ask_met():
-            send_mail(
-                "[codesy] Your ask for %(ask)d for %(url)s has been met" %
-                (
-                    {'ask': bid.ask, 'url': bid.url}
-                ),
-                ASKER_NOTIFICATION_EMAIL_STRING.format(url=bid.url),
-                settings.DEFAULT_FROM_EMAIL,
-                [bid.user.email]
-            )
-            # use .update to avoid recursive signal processing
-            Bid.objects.filter(id=bid.id).update(ask_match_sent=datetime.now())
+    try:
+        offer_total = OfferTotal.objects.get(url=url).offer
+    except OfferTotal.DoesNotExist:
+        return
+
+    # an ask is met when the offers of everyone else cover it
+    met_asks = list(Bid.objects.filter(
+        url=url,
+        ask_match_sent=None,
+        ask__gt=0,
+        ask__lte=offer_total - F('offer'),
+    ).select_related('user').order_by('id'))
+    if not met_asks:
+        return
 
+    # use .update to avoid recursive signal processing
+    Bid.objects.filter(
+        id__in=[bid.id for bid in met_asks]
+    ).update(ask_match_sent=timezone.now())
+
+    send_mass_mail(
+        ("[codesy] Your ask for %(ask)d for %(url)s has been met" %
+         ({'ask': bid.ask, 'url': bid.url}),
+         ASKER_NOTIFICATION_EMAIL_STRING.format(url=bid.url),
+         settings.DEFAULT_FROM_EMAIL,
+         [bid.user.email])
+        for bid in met_asks
+    )
 
-@receiver(post_save, sender=Bid)
+
+@receiver(pre_save, sender=Bid)
 def create_issue_for_bid(sender, instance, **kwargs):
-    issue, created = Issue.objects.get_or_create(
-        url=instance.url,
-        defaults={'state': 'unknown', 'last_fetched': None}
-    )
-    # use .update to avoid recursive signal processing
-    Bid.objects.filter(id=instance.id).update(issue=issue)
+    # link the issue before the bid is written so it takes one statement
+    if instance.issue_id is None or instance.moved_from():
+        instance.issue, created = Issue.objects.get_or_create(
+            url=instance.url,
+            defaults={'state': 'unknown', 'last_fetched': None}
+        )
 
 
 class Issue(models.Model):
@@ -169,10 +324,16 @@ class Issue(models.Model):
     title = models.CharField(max_length=255, null=True, blank=True)
     state = models.CharField(max_length=255)
     last_fetched = models.DateTimeField(auto_now=True)
+    # validators for conditional GitHub API requests
+    etag = models.CharField(max_length=255, blank=True)
+    last_modified = models.CharField(max_length=255, blank=True)
 
     def __unicode__(self):
         return u'Issue for %s (%s)' % (self.url, self.state)
 
+    def cache_tags(self):
+        return [market_tag(self.url)]
+
 
 class Claim(models.Model):
     STATUS_CHOICES = (
@@ -191,17 +352,27 @@ class Claim(models.Model):
     status = models.CharField(max_length=255,
                               choices=STATUS_CHOICES,
                               default='Submitted')
+    # vote tally, kept current by process_vote and
+    # update_claim_eligible_voters so status needs no COUNT queries
+    eligible_voters = models.PositiveIntegerField(default=0)
+    approvals = models.PositiveIntegerField(default=0)
+    rejections = models.PositiveIntegerField(default=0)
 
     objects = ClaimManager()
 
     class Meta:
         unique_together = (("user", "issue"),)
+        index_together = (("user", "id"),)
 
     def __unicode__(self):
         return u'%s claim on Issue %s (%s)' % (
             self.user, self.issue.id, self.status
         )
 
+    def cache_tags(self):
+        return [market_tag(self.issue.url), 'user:%s' % self.user_id,
+                'claim:%s' % self.id]
+
     def payouts(self):
         return Payout.objects.filter(claim=self)
 
@@ -209,8 +380,15 @@ class Claim(models.Model):
         return Payout.objects.filter(claim=self, api_success=True)
 
     def payout_request(self):
+        """
+        Queue a payout of the claimant's ask. The claim is marked Paid
+        once PayPal reports the payout item succeeded.
+        """
         if self.status == 'Paid':
             return False
+        if self.payouts.filter(api_success=False, error_message='').exists():
+            # already waiting on PayPal
+            return True
 
         bid = Bid.objects.get(url=self.issue.url, user=self.user)
 
@@ -220,11 +398,7 @@ class Claim(models.Model):
             amount=bid.ask,
         )
         payout.save()
-        payout_attempt = payout.request()
-        if payout.api_success is True:
-            self.status = 'Paid'
-            self.save()
-        return payout_attempt
+        return payout.request()
 
     def votes_by_approval(self, approved):
         return (Vote.objects
@@ -258,10 +432,52 @@ class Claim(models.Model):
 
     @property
     def offers(self):
-        return (Bid.objects.filter(issue=self.issue)
-                           .exclude(user=self.user)
+        return (Bid.objects.filter(issue_id=self.issue_id)
+                           .exclude(user_id=self.user_id)
                            .filter(offer__gt=0))
 
+    def recount_votes(self):
+        """
+        Recompute the tally from the Bid and Vote tables.
+        """
+        self.eligible_voters = self.offers.count()
+        self.approvals = self.num_approvals
+        self.rejections = self.num_rejections
+
+    def tally_vote(self, vote, created):
+        """
+        Count a new or changed vote into approvals and rejections.
+        """
+        if vote.user_id == self.user_id:
+            # the claimant's own vote doesn't count
+            return
+        if not created:
+            if not hasattr(vote, '_tallied_approved'):
+                # we don't know what this vote was counted as
+                self.recount_votes()
+                return
+            if vote._tallied_approved == vote.approved:
+                return
+            self._count_vote(vote._tallied_approved, -1)
+        self._count_vote(vote.approved, 1)
+
+    def _count_vote(self, approved, step):
+        if approved:
+            self.approvals += step
+        else:
+            self.rejections += step
+
+    def status_from_tally(self):
+        status = self.status
+        if self.approvals + self.rejections > 0:
+            status = 'Pending'
+        if self.approvals == self.eligible_voters:
+            status = 'Approved'
+        if self.eligible_voters > 0:
+            if (self.rejections / float(self.eligible_voters)) >= 0.5:
+                status = 'Rejected'
+        return status
+
     @property
     def expires(self):
         return self.created + timedelta(days=30)
@@ -270,6 +486,27 @@ class Claim(models.Model):
         return reverse('claim-status', kwargs={'pk': self.id})
 
 
+@receiver(pre_save, sender=Claim)
+def count_claim_eligible_voters(sender, instance, **kwargs):
+    if instance.pk is None:
+        instance.eligible_voters = instance.offers.count()
+
+
+@receiver(post_save, sender=Bid)
+@receiver(post_delete, sender=Bid)
+def update_claim_eligible_voters(sender, instance, **kwargs):
+    update_eligible_voters(instance.url)
+    if instance.moved_from():
+        update_eligible_voters(instance.moved_from())
+
+
+def update_eligible_voters(url):
+    # offerers on an issue are the voters on its claims
+    for claim in Claim.objects.filter(issue__url=url):
+        Claim.objects.filter(id=claim.id).update(
+            eligible_voters=claim.offers.count())
+
+
 @receiver(post_save, sender=Claim)
 def notify_matching_offerers(sender, instance, created, **kwargs):
     # Only notify when the claim is first created
@@ -285,51 +522,114 @@ def notify_matching_offerers(sender, instance, created, **kwargs):
     To approve or reject this claim, go to:
     https://{site}{claim_link}
     """
-    current_site = Site.objects.get_current()
-
-    self_Q = models.Q(user=instance.user)
-    offered0_Q = models.Q(offer=0)
-    others_bids = Bid.objects.filter(
-        issue=instance.issue
-    ).exclude(
-        self_Q | offered0_Q
+    # one query for every other offerer's offer and email
+    offerers = (Bid.objects.filter(issue_id=instance.issue_id)
+                           .exclude(models.Q(user_id=instance.user_id) |
+                                    models.Q(offer=0))
+                           .order_by('id')
+                           .values_list('offer', 'user__email'))
+    if not offerers:
+        return
+
+    # the parts every message shares are rendered once
+    subject = ("[codesy] %(user)s has claimed payout for %(url)s" %
+               ({'user': instance.user, 'url': instance.issue.url}))
+    message = {
+        'user': instance.user,
+        'url': instance.issue.url,
+        'site': Site.objects.get_current(),
+        'claim_link': instance.get_absolute_url(),
+    }
+
+    send_mass_mail(
+        (subject,
+         OFFERER_NOTIFICATION_EMAIL_STRING.format(offer=offer, **message),
+         settings.DEFAULT_FROM_EMAIL,
+         [email])
+        for offer, email in offerers
     )
 
-    for bid in others_bids:
-        send_mail(
-            "[codesy] %(user)s has claimed payout for %(url)s" %
-            (
-                {'user': instance.user, 'url': instance.issue.url}
-            ),
-            OFFERER_NOTIFICATION_EMAIL_STRING.format(
-                user=instance.user,
-                url=instance.issue.url,
-                offer=bid.offer,
-                site=current_site,
-                claim_link=instance.get_absolute_url()
-            ),
-            settings.DEFAULT_FROM_EMAIL,
-            [bid.user.email]
-        )
 
+class TitleFetchJob(models.Model):
+    """
+    A url whose page title still needs to be fetched. Drained by the
+    fetch_titles command so saves never wait on the network.
+    """
+    MAX_ATTEMPTS = 5
+    BACKOFF_SECONDS = 60
 
-@receiver(post_save, sender=Bid)
-@receiver(post_save, sender=Issue)
-@receiver(post_save, sender=Claim)
+    url = models.URLField(unique=True, db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt = models.DateTimeField(default=timezone.now, db_index=True)
+    last_error = models.CharField(max_length=255, blank=True)
+    created = models.DateTimeField(default=timezone.now)
+
+    def __unicode__(self):
+        return u'Title fetch for %s (%s attempts)' % (self.url, self.attempts)
+
+    @classmethod
+    def enqueue(cls, url):
+        # unique url means one pending fetch no matter how many rows share it
+        job, created = cls.objects.get_or_create(url=url)
+        return job
+
+    def retry(self, error):
+        """
+        Back off exponentially, or give up after MAX_ATTEMPTS.
+        """
+        self.attempts += 1
+        if self.attempts >= self.MAX_ATTEMPTS:
+            self.delete()
+            return
+        delay = self.BACKOFF_SECONDS * 2 ** (self.attempts - 1)
+        self.next_attempt = timezone.now() + timedelta(seconds=delay)
+        self.last_error = unicode(error)[:255]
+        self.save()
+
+
+class PageTitle(models.Model):
+    """
+    Title cache keyed by url. Entries are reused while fresh and
+    revalidated with their ETag/Last-Modified once stale.
+    """
+    FRESH_FOR = timedelta(days=1)
+
+    url = models.URLField(unique=True, db_index=True)
+    title = models.CharField(max_length=255, blank=True)
+    etag = models.CharField(max_length=255, blank=True)
+    last_modified = models.CharField(max_length=255, blank=True)
+    fetched = models.DateTimeField(null=True, blank=True)
+
+    def __unicode__(self):
+        return u'Title of %s' % self.url
+
+    def is_fresh(self):
+        return bool(self.fetched and
+                    self.fetched + self.FRESH_FOR > timezone.now())
+
+
+@receiver(pre_save, sender=Bid)
+@receiver(pre_save, sender=Issue)
+@receiver(pre_save, sender=Claim)
 def save_title(sender, instance, **kwargs):
     if isinstance(instance, Claim):
         url = instance.evidence
     else:
         url = instance.url
 
+    if not url:
+        return
+
     try:
-        r = requests.get(url)
-        title_search = re.search('(?:<title.*>)(.*)(?:<\/title>)', r.text)
-        if title_search:
-            title = HTMLParser.HTMLParser().unescape(title_search.group(1))
-            type(instance).objects.filter(id=instance.id).update(title=title)
-    except:
-        pass
+        page = PageTitle.objects.get(url=url)
+    except PageTitle.DoesNotExist:
+        page = None
+
+    if page and page.title:
+        # set before the row is written so the save takes one statement
+        instance.title = page.title
+    if page is None or not page.is_fresh():
+        TitleFetchJob.enqueue(url)
 
 
 class Vote(models.Model):
@@ -342,70 +642,75 @@ class Vote(models.Model):
 
     class Meta:
         unique_together = (("user", "claim"),)
+        index_together = (("user", "id"),)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        vote = super(Vote, cls).from_db(db, field_names, values)
+        # what process_vote already counted this vote as
+        vote._tallied_approved = vote.approved
+        return vote
 
     def __unicode__(self):
         return u'Vote for %s by (%s): %s' % (
             self.claim, self.user, self.approved
         )
 
-
-@receiver(post_save, sender=Vote)
-def update_claim_status(sender, instance, created, **kwargs):
-    claim = instance.claim
-    offers_needed = claim.offers.count()
-
-    if claim.num_votes > 0:
-        claim.status = "Pending"
-        claim.save()
-
-    if claim.num_approvals == offers_needed:
-        claim.status = "Approved"
-        claim.save()
-
-    if offers_needed > 0:
-        if (claim.num_rejections / float(offers_needed)) >= 0.5:
-            claim.status = "Rejected"
-            claim.save()
+    def cache_tags(self):
+        # process_vote invalidates the claim's tags, market included
+        return ['user:%s' % self.user_id, 'claim:%s' % self.claim_id]
 
 
 @receiver(post_save, sender=Vote)
-def notify_approved_claim(sender, instance, created, **kwargs):
-    claim = instance.claim
-    votes_needed = claim.offers.count()
-
-    if claim.num_rejections == votes_needed:
-        current_site = Site.objects.get_current()
-        # TODO: make a nicer HTML email template
-        CLAIM_REJECTED_EMAIL_STRING = """
-        Your claim for {url} has been rejected.
-        https://{site}
-        """
-        send_mail(
-            "[codesy] Your claimed has been rejected",
-            CLAIM_REJECTED_EMAIL_STRING.format(
-                url=claim.issue.url,
-                site=current_site,
-            ),
-            settings.DEFAULT_FROM_EMAIL,
-            [claim.user.email]
+def process_vote(sender, instance, created, **kwargs):
+    """
+    Tally the vote, write the claim's counters and status in one UPDATE,
+    and tell the claimant if the vote decided their claim.
+    """
+    with transaction.atomic():
+        # lock the claim so concurrent votes tally in turn
+        claim = (Claim.objects.select_for_update().select_related('issue')
+                              .get(id=instance.claim_id))
+        previous_status = claim.status
+        previous_rejections = claim.rejections
+        claim.tally_vote(instance, created)
+        claim.status = claim.status_from_tally()
+        # the tally and status in one UPDATE
+        Claim.objects.filter(id=claim.id).update(
+            eligible_voters=claim.eligible_voters,
+            approvals=claim.approvals,
+            rejections=claim.rejections,
+            status=claim.status,
+            modified=timezone.now(),
         )
+        instance._tallied_approved = instance.approved
+    # the .update above skips the claim's own receivers
+    invalidation.invalidate(*claim.cache_tags())
 
-    if votes_needed == claim.num_approvals:
-        current_site = Site.objects.get_current()
-        # TODO: make a nicer HTML email template
-        CLAIM_APPROVED_EMAIL_STRING = """
-        Your claim for {url} has been approved.
-        https://{site}
-        """
-        send_mail(
-            "[codesy] Your claimed has been approved",
-            CLAIM_APPROVED_EMAIL_STRING.format(
-                url=claim.issue.url,
-                site=current_site,
-            ),
-            settings.DEFAULT_FROM_EMAIL,
-            [claim.user.email]
-        )
+    # TODO: make a nicer HTML email template
+    CLAIM_DECIDED_EMAIL_STRING = """
+    Your claim for {url} has been {decision}.
+    https://{site}
+    """
+    if claim.status == 'Approved' and previous_status != 'Approved':
+        decision = 'approved'
+    elif (claim.status == 'Rejected' and
+          claim.rejections == claim.eligible_voters and
+          previous_rejections != claim.rejections):
+        # the claimant hears once every offerer has rejected it
+        decision = 'rejected'
+    else:
+        return
+    send_mail(
+        "[codesy] Your claimed has been %s" % decision,
+        CLAIM_DECIDED_EMAIL_STRING.format(
+            url=claim.issue.url,
+            decision=decision,
+            site=Site.objects.get_current(),
+        ),
+        settings.DEFAULT_FROM_EMAIL,
+        [claim.user.email]
+    )
 
 
 class Payment(models.Model):
@@ -427,8 +732,9 @@ class Payment(models.Model):
     modified = models.DateTimeField(null=True, blank=True, auto_now=True)
 
     def short_key(self):
-        return (self.transaction_key
-                .bytes.encode('base64').rstrip('=\n').replace('/', '_'))
+        # transaction_key is a UUID until the row is reloaded as a string
+        key = uuid.UUID(str(self.transaction_key))
+        return key.bytes.encode('base64').rstrip('=\n').replace('/', '_')
 
     class Meta:
         abstract = True
@@ -442,75 +748,85 @@ class Offer(Payment):
         default='Stripe')
 
     def fees(self):
-        return OfferFee.objects.filter(offer=self)
+        return self.offer_fees.all()
 
     def __unicode__(self):
         return u'Offer payment for bid (%s) paid' % (
             self.bid.id
         )
 
-    def request(self):
-        codesy_pct = Decimal('0.025')
-
-        codesy_fee = OfferFee(
-            offer=self,
-            fee_type='codesy',
-            amount=self.amount * codesy_pct
-        )
-        codesy_fee.save()
-
-        stripe_pct = Decimal('0.029')
-        stripe_transaction = Decimal('0.30')
-
-        stripe_charge = (
-            (self.amount + codesy_fee.amount + stripe_transaction)
-            / (1 - stripe_pct)
-        )
-
-        stripe_fee = stripe_charge - (self.amount + codesy_fee.amount)
+    def cache_tags(self):
+        return ['user:%s' % self.user_id, 'bid:%s' % self.bid_id]
 
-        stripe_fee = OfferFee(
-            offer=self,
-            fee_type='Stripe',
-            amount=stripe_fee
-        )
-        stripe_fee.save()
-
-        # get rounded fee values
-        fees = OfferFee.objects.filter(offer=self)
-        sum_fees = fees.aggregate(Sum('amount'))['amount__sum']
-
-        stripe_charge = self.amount + sum_fees
+    def payment_status(self):
+        if self.api_success:
+            return 'succeeded'
+        if self.error_message:
+            return 'failed'
+        return 'pending'
 
-        # TODO: removed with proper stripe mocking in tests
-        self.charge_amount = stripe_charge
-        self.save()
+    def request(self):
+        schedule = fees.offer_fees(self.amount)
+        # a retried request is deduped by Stripe, and mustn't add its fees
+        # a second time either
+        if not self.offer_fees.exists():
+            OfferFee.objects.bulk_create(
+                OfferFee(offer=self, fee_type=fee_type, amount=amount)
+                for fee_type, amount in schedule.fees
+            )
+        self.charge_amount = schedule.charge_amount
 
         # TODO: HANDLE CARD NOT YET REGISTERED
         try:
             charge = stripe.Charge.create(
-                amount=int(stripe_charge * 100),
+                amount=int(self.charge_amount * 100),
                 currency="usd",
                 customer=self.user.stripe_account_token,
                 description="Offer for: " + self.bid.url,
-                metadata={'id': self.id}
+                metadata={'id': self.id},
+                # a retried request can't charge the card twice
+                idempotency_key=str(self.transaction_key),
             )
             if charge:
-                self.charge_amount = stripe_charge
                 self.confirmation = charge.id
                 self.api_success = True
-                self.offer = self
-                self.save()
             else:
                 self.error_message = "Charge failed, try later"
-                self.save()
-                return False
         except Exception as e:
             self.error_message = e.message
-            self.save()
-            return False
+        self.save()
+        return self.api_success
 
-        return True
+
+class OfferPaymentJob(models.Model):
+    """
+    An offer waiting to be charged. Queued by BidStatusView.post and
+    drained by the process_offer_payments command, so the request never
+    waits on Stripe.
+    """
+    offer = models.OneToOneField(Offer, related_name='payment_job')
+    # what bid.offer becomes once the charge succeeds
+    bid_offer = models.DecimalField(max_digits=6, decimal_places=2)
+    created = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __unicode__(self):
+        return u'Payment job for offer (%s)' % self.offer_id
+
+    def run(self):
+        """
+        Charge the offer, update the bid if it went through, and finish
+        the job either way. Returns whether the charge succeeded.
+        """
+        offer = self.offer
+        charged = offer.request()
+        if charged:
+            with transaction.atomic():
+                # reload, so edits made to the bid during the charge stay
+                bid = Bid.objects.select_for_update().get(pk=offer.bid_id)
+                bid.offer = self.bid_offer
+                bid.save()
+        self.delete()
+        return charged
 
 
 class Payout(Payment):
@@ -519,6 +835,12 @@ class Payout(Payment):
         max_length=255,
         choices=Payment.PROVIDER_CHOICES,
         default='PayPal')
+    # set before the batch is sent, so a retry reuses it and PayPal
+    # rejects the duplicate instead of paying twice
+    sender_batch_id = models.CharField(max_length=30, blank=True,
+                                       db_index=True)
+    # PayPal's payout_batch_id, once the batch is accepted
+    batch_id = models.CharField(max_length=255, blank=True, db_index=True)
 
     def __unicode__(self):
         return u'Payout to %s for claim (%s)' % (
@@ -526,66 +848,25 @@ class Payout(Payment):
         )
 
     def fees(self):
-        return PayoutFee.objects.filter(payout=self)
+        return self.payout_fees.all()
 
     def request(self):
-        receiver = (
-            PAYPAL_PAYOUT_RECIPIENT if PAYPAL_PAYOUT_RECIPIENT
-            else self.claim.user.email
-        )
-        paypal_fee = PayoutFee(
-            payout=self,
-            fee_type='PayPal',
-            amount=Decimal('0.25')
-        )
-        paypal_fee.save()
-
-        codesy_fee = PayoutFee(
-            payout=self,
-            fee_type='codesy',
-            amount=self.amount * Decimal('0.025'),
+        """
+        Price the payout and queue it for the next PayPal batch; see
+        auctions.payouts.
+        """
+        schedule = fees.payout_fees(self.amount)
+        PayoutFee.objects.bulk_create(
+            PayoutFee(payout=self, fee_type=fee_type, amount=amount)
+            for fee_type, amount in schedule.fees
         )
-        codesy_fee.save()
-
-        total_fees = paypal_fee.amount + codesy_fee.amount
-        self.charge_amount = self.amount - total_fees
+        self.charge_amount = schedule.charge_amount
         self.save()
-        # attempt paypal payout
-        # user generated id sent to paypal is limited to 30 chars
-        sender_id = self.short_key()
-        paypal_payout = PaypalPayout({
-            "sender_batch_header": {
-                "sender_batch_id": sender_id,
-                "email_subject": "Your codesy payout is here!"
-            },
-            "items": [
-                {
-                    "recipient_type": "EMAIL",
-                    "amount": {
-                        "value": int(self.charge_amount),
-                        "currency": "USD"
-                    },
-                    "receiver": receiver,
-                    "note": "Here's your payout for fixing an issue.",
-                    "sender_item_id": sender_id
-                }
-            ]
-        })
-        try:
-            payout_attempt = paypal_payout.create(sync_mode=True)
-        except:
-            payout_attempt = False
-
-        if payout_attempt:
-            if paypal_payout.items:
-                for item in paypal_payout.items:
-                    if item.transaction_status == "SUCCESS":
-                        self.api_success = True
-                        self.confirmation = item.payout_item_id
-                        self.save()
-                    else:
-                        payout_attempt = False
-        return payout_attempt
+        return True
+
+    def receiver(self):
+        return (PAYPAL_PAYOUT_RECIPIENT if PAYPAL_PAYOUT_RECIPIENT
+                else self.claim.user.email)
 
 
 class Fee(models.Model):
@@ -617,17 +898,30 @@ class PayoutFee(Fee):
 @receiver(pre_save, sender=OfferFee)
 @receiver(pre_save, sender=PayoutFee)
 def roundup_penny(sender, instance, *args, **kwargs):
-    instance.amount = (instance.amount.quantize(Decimal('.01'),
-                       rounding=ROUND_UP))
+    instance.amount = fees.roundup_penny(instance.amount)
+
+
+@receiver(pre_save, sender=Payout)
+@receiver(pre_save, sender=Offer)
+@receiver(pre_save, sender=Bid)
+@receiver(pre_save, sender=Claim)
+@receiver(pre_save, sender=Vote)
+def set_created_datetime(sender, instance, **kwargs):
+    # modified is auto_now; created goes out with the same INSERT
+    if instance.created is None:
+        instance.created = timezone.now()
 
 
-@receiver(post_save, sender=Payout)
-@receiver(post_save, sender=Offer)
 @receiver(post_save, sender=Bid)
+@receiver(post_delete, sender=Bid)
+@receiver(post_save, sender=Issue)
+@receiver(post_delete, sender=Issue)
 @receiver(post_save, sender=Claim)
+@receiver(post_delete, sender=Claim)
 @receiver(post_save, sender=Vote)
-def update_datetimes_for_model_save(sender, instance, created, **kwargs):
-    if created:
-        sender.objects.filter(id=instance.id).update(created=datetime.now())
-    else:
-        sender.objects.filter(id=instance.id).update(modified=datetime.now())
+@receiver(post_delete, sender=Vote)
+@receiver(post_save, sender=Offer)
+@receiver(post_delete, sender=Offer)
+def invalidate_cache_tags(sender, instance, **kwargs):
+    # registered last, so it runs after the other receivers' writes
+    invalidation.invalidate(*instance.cache_tags())
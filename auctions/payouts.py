@@ -0,0 +1,158 @@
+"""
+Batched PayPal payouts.
+
+Claim.payout_request only prices and queues a Payout. send_payout_batches
+gathers queued payouts into PayPal sender batches, created without
+waiting on PayPal (sync_mode off), and poll_payout_batches reads the
+item statuses back, marking payouts and their claims paid.
+"""
+from django.utils import timezone
+from paypalrestsdk import Payout as PaypalPayout
+
+from codesy import invalidation
+
+from .models import Claim, Payout, uuid_please
+
+# PayPal accepts up to 15000 items per batch
+PAYOUT_BATCH_SIZE = 500
+# item statuses that mean the money won't arrive
+FAILED_ITEM_STATUSES = ('FAILED', 'RETURNED', 'BLOCKED', 'REFUNDED',
+                        'REVERSED')
+
+
+def _unsent():
+    return Payout.objects.filter(batch_id='', api_success=False,
+                                 error_message='')
+
+
+def _create_batch(sender_batch_id, payouts, api=None):
+    paypal_payout = PaypalPayout({
+        "sender_batch_header": {
+            "sender_batch_id": sender_batch_id,
+            "email_subject": "Your codesy payout is here!"
+        },
+        "items": [
+            {
+                "recipient_type": "EMAIL",
+                "amount": {
+                    "value": str(payout.charge_amount),
+                    "currency": "USD"
+                },
+                "receiver": payout.receiver(),
+                "note": "Here's your payout for fixing an issue.",
+                "sender_item_id": payout.short_key()
+            }
+            for payout in payouts
+        ]
+    }, api=api)
+    try:
+        created = paypal_payout.create(sync_mode=False)
+    except Exception:
+        created = False
+    payout_ids = [p.id for p in payouts]
+    if created:
+        batch_id = paypal_payout.batch_header.payout_batch_id
+    else:
+        error = paypal_payout.error or {}
+        if error.get('name') != 'USER_BUSINESS_ERROR':
+            # worth sending again
+            return False
+        batch_id = _linked_batch_id(error)
+        if not batch_id:
+            # resending won't help; free the claims to be paid again
+            Payout.objects.filter(id__in=payout_ids).update(
+                error_message="PayPal refused batch: %s" %
+                              error.get('message', ''))
+            return False
+    Payout.objects.filter(id__in=payout_ids).update(batch_id=batch_id)
+    return True
+
+
+def _linked_batch_id(error):
+    """
+    PayPal refuses a sender_batch_id it already accepted -- say the reply
+    to the first send was lost -- and links to that batch. Returns its
+    payout_batch_id, or None when the error has no such link.
+    """
+    for link in error.get('links') or []:
+        if link.get('rel') == 'self':
+            return link['href'].rstrip('/').rsplit('/', 1)[-1]
+    return None
+
+
+def send_payout_batches(api=None, batch_size=PAYOUT_BATCH_SIZE):
+    """
+    Send queued payouts to PayPal, up to batch_size per sender batch.
+    Batches PayPal didn't accept are sent again under the same
+    sender_batch_id; if PayPal had accepted it after all, the refusal of
+    the duplicate names the batch. Returns the number of batches
+    accepted.
+    """
+    queued = list(_unsent().filter(sender_batch_id='')
+                           .order_by('id')
+                           .values_list('id', flat=True))
+    for start in range(0, len(queued), batch_size):
+        Payout.objects.filter(id__in=queued[start:start + batch_size]) \
+                      .update(sender_batch_id=uuid_please())
+
+    sent = 0
+    # oldest batch first
+    sender_batch_ids = []
+    for sender_batch_id in (_unsent().order_by('id')
+                                     .values_list('sender_batch_id',
+                                                  flat=True)):
+        if sender_batch_id not in sender_batch_ids:
+            sender_batch_ids.append(sender_batch_id)
+    for sender_batch_id in sender_batch_ids:
+        payouts = list(_unsent().filter(sender_batch_id=sender_batch_id)
+                                .select_related('claim__user')
+                                .order_by('id'))
+        if _create_batch(sender_batch_id, payouts, api=api):
+            sent += 1
+    return sent
+
+
+def poll_payout_batches(api=None):
+    """
+    Fetch the status of every batch with unsettled payouts. Successful
+    items mark their payout and claim paid; failed items record the
+    status as the payout's error. Returns (paid, failed) counts.
+    """
+    unsettled = (Payout.objects.filter(api_success=False, error_message='')
+                               .exclude(batch_id=''))
+    paid = failed = 0
+    for batch_id in set(unsettled.values_list('batch_id', flat=True)):
+        try:
+            batch = PaypalPayout.find(batch_id, api=api)
+        except Exception:
+            continue
+        payouts = dict((payout.short_key(), payout)
+                       for payout in unsettled.filter(batch_id=batch_id))
+        paid_claims = []
+        failures = {}
+        for item in batch.items or []:
+            payout = payouts.get(item.payout_item.sender_item_id)
+            if payout is None:
+                continue
+            if item.transaction_status == 'SUCCESS':
+                Payout.objects.filter(id=payout.id).update(
+                    api_success=True, confirmation=item.payout_item_id)
+                paid_claims.append(payout.claim_id)
+            elif item.transaction_status in FAILED_ITEM_STATUSES:
+                failures.setdefault(item.transaction_status, []).append(
+                    payout.id)
+        for status, ids in failures.items():
+            Payout.objects.filter(id__in=ids).update(
+                error_message="PayPal item %s" % status)
+            failed += len(ids)
+        if paid_claims:
+            # one UPDATE for every paid claim; it skips the claims'
+            # receivers, so their cache tags are invalidated here
+            Claim.objects.filter(id__in=paid_claims).update(
+                status='Paid', modified=timezone.now())
+            invalidation.invalidate(*[
+                tag for claim in (Claim.objects.filter(id__in=paid_claims)
+                                               .select_related('issue'))
+                for tag in claim.cache_tags()])
+            paid += len(paid_claims)
+    return paid, failed
@@ -1,7 +1,7 @@
 from model_mommy import mommy
 
 from django.conf import settings
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
 
 from ..models import Bid, Claim, Issue
 
@@ -10,14 +10,6 @@ import fudge
 
 def setUpPackage(self):
 
-    mock_get = fudge.Fake().is_callable().returns(
-        fudge.Fake().has_attr(text='<title>Howdy Dammit</title>')
-    )
-
-    self.patch_request = fudge.patch_object(
-        'auctions.models.requests', 'get', mock_get
-    )
-
     mock_create = fudge.Fake().has_attr(id='dammit')
 
     mock_stripe = (
@@ -27,27 +19,9 @@ def setUpPackage(self):
     self.patch_stripe = fudge.patch_object(
         'auctions.models.stripe', 'Charge', mock_stripe)
 
-    fake_items = [fudge.Fake().has_attr(
-        transaction_status='SUCCESS',
-        payout_item_id='Howdy'),
-    ]
-
-    mock_paypal = (
-        fudge.Fake().is_callable().returns(
-            fudge.Fake().provides('create').returns(True)
-            .has_attr(items=fake_items)
-        )
-    )
-
-    self.patch_paypal = fudge.patch_object(
-        'auctions.models', 'PaypalPayout', mock_paypal
-    )
-
 
 def tearDownPackage(self):
-    self.patch_request.restore()
     self.patch_stripe.restore()
-    self.patch_paypal.restore()
 
 
 class MarketWithBidsTestCase(TestCase):
@@ -78,7 +52,7 @@ class MarketWithBidsTestCase(TestCase):
         return string.format(url=self.url)
 
 
-class MarketWithClaimTestCase(TestCase):
+class MarketWithClaimMixin(object):
     def setUp(self):
         """
         Set up the following claim senarios
@@ -103,3 +77,15 @@ class MarketWithClaimTestCase(TestCase):
         self.bid3 = mommy.make(Bid, user=self.user3,
                                ask=0, offer=25, url=self.url, issue=self.issue)
         self.claim = mommy.make(Claim, user=self.user1, issue=self.issue)
+
+
+class MarketWithClaimTestCase(MarketWithClaimMixin, TestCase):
+    pass
+
+
+class MarketWithClaimTransactionTestCase(MarketWithClaimMixin,
+                                         TransactionTestCase):
+    """
+    For tests of work deferred with transaction.on_commit, which never
+    runs inside TestCase's transaction.
+    """
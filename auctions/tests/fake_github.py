@@ -0,0 +1,102 @@
+import json
+import threading
+import urlparse
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+
+class FakeGithubHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse.urlparse(self.path)
+        params = dict(urlparse.parse_qsl(url.query))
+        server.requests.append((url.path, params, dict(self.headers)))
+
+        parts = url.path.strip('/').split('/')
+        if parts == ['rate_limit']:
+            self.rate_limit()
+        elif (len(parts) >= 4 and parts[0] == 'repos' and
+              parts[3] == 'issues' and '/'.join(parts[1:3]) in server.issues):
+            issues = server.issues['/'.join(parts[1:3])]
+            if not isinstance(issues, list):
+                self.send_json(issues, {'message': 'Server Error'})
+            elif len(parts) == 4:
+                self.list_issues(issues, params)
+            else:
+                self.get_issue(issues, int(parts[4]))
+        else:
+            self.send_json(404, {'message': 'Not Found'})
+
+    def rate_limit(self):
+        remaining, reset = self.server.rate_limit
+        rate = {'limit': 5000, 'remaining': remaining, 'reset': reset}
+        self.send_json(200, {'resources': {'core': rate}, 'rate': rate})
+
+    def get_issue(self, issues, number):
+        for issue in issues:
+            if issue['number'] == number:
+                etag = '"%s-%s"' % (number, issue['state'])
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_json(304, None)
+                else:
+                    self.send_json(200, issue, {'ETag': etag})
+                return
+        self.send_json(404, {'message': 'Not Found'})
+
+    def list_issues(self, issues, params):
+        since = params.get('since', '')
+        issues = [i for i in issues if i['updated_at'] >= since]
+        per_page = int(params.get('per_page', 30))
+        page = int(params.get('page', 1))
+        headers = {}
+        if page * per_page < len(issues):
+            next_params = dict(params, page=page + 1)
+            headers['Link'] = '<%s%s?%s>; rel="next"' % (
+                self.server.base_url, self.path.split('?')[0],
+                '&'.join('%s=%s' % item for item in next_params.items()))
+        self.send_json(200, issues[(page - 1) * per_page:page * per_page],
+                       headers)
+
+    def send_json(self, status, data, headers=None):
+        body = json.dumps(data) if data is not None else ''
+        remaining, reset = self.server.rate_limit
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('X-RateLimit-Limit', '5000')
+        self.send_header('X-RateLimit-Remaining', str(remaining))
+        self.send_header('X-RateLimit-Reset', str(reset))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeGithubServer(HTTPServer):
+    """
+    A local stand-in for the GitHub API, serving issues and repository
+    issue listings from ``issues``:
+    {'owner/repo': [{'number':, 'state':, 'updated_at':}]}.
+    Single issues carry an ETag and honor If-None-Match; repositories not
+    in ``issues`` are 404s and those mapped to a status code answer every
+    request with it. Every request is recorded in ``requests``.
+    """
+    def __init__(self, issues=None, rate_limit=(5000, 0)):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), FakeGithubHandler)
+        self.issues = issues or {}
+        self.rate_limit = rate_limit
+        self.requests = []
+        self.base_url = 'http://127.0.0.1:%s' % self.server_port
+        self.thread = threading.Thread(target=self.serve_forever,
+                                       args=(0.01,))
+        self.thread.daemon = True
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,129 @@
+import json
+import threading
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+
+class FakePaypalHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length)
+        try:
+            return json.loads(body)
+        except ValueError:
+            return None
+
+    def do_POST(self):
+        server = self.server
+        path = self.path.split('?')[0].rstrip('/')
+        body = self.read_json()
+        if path == '/v1/oauth2/token':
+            self.send_json(200, {'access_token': 'token',
+                                 'token_type': 'Bearer',
+                                 'expires_in': 3600})
+        elif path == '/v1/payments/payouts':
+            server.requests.append(body)
+            self.create_batch(body)
+        else:
+            self.send_json(404, {'name': 'NOT_FOUND'})
+
+    def create_batch(self, body):
+        server = self.server
+        header = body['sender_batch_header']
+        if server.fail_creates:
+            server.fail_creates -= 1
+            self.send_json(500, {'name': 'INTERNAL_SERVICE_ERROR'})
+            return
+        sender_batch_id = header['sender_batch_id']
+        if sender_batch_id in server.sender_batch_ids:
+            error = {'name': 'USER_BUSINESS_ERROR',
+                     'message': 'Batch with given sender_batch_id already '
+                                'exists'}
+            if server.link_duplicates:
+                error['links'] = [{
+                    'href': '%s/v1/payments/payouts/%s' % (
+                        server.base_url,
+                        server.sender_batch_ids[sender_batch_id]),
+                    'rel': 'self',
+                    'method': 'GET',
+                }]
+            self.send_json(400, error)
+            return
+        batch_id = 'BATCH%s' % (len(server.batches) + 1)
+        server.sender_batch_ids[sender_batch_id] = batch_id
+        server.batches[batch_id] = body['items']
+        if server.lose_creates:
+            server.lose_creates -= 1
+            self.send_json(500, {'name': 'INTERNAL_SERVICE_ERROR'})
+            return
+        self.send_json(201, {'batch_header': {
+            'payout_batch_id': batch_id,
+            'batch_status': 'PENDING',
+            'sender_batch_header': header,
+        }})
+
+    def do_GET(self):
+        server = self.server
+        parts = self.path.split('?')[0].strip('/').split('/')
+        if parts[:3] == ['v1', 'payments', 'payouts'] and len(parts) == 4:
+            items = server.batches.get(parts[3])
+            if items is None:
+                self.send_json(404, {'name': 'INVALID_RESOURCE_ID'})
+                return
+            self.send_json(200, {
+                'batch_header': {'payout_batch_id': parts[3]},
+                'items': [{
+                    'payout_item_id': '%s-ITEM%s' % (parts[3], n),
+                    'transaction_status': server.statuses.get(
+                        item['receiver'], 'PENDING'),
+                    'payout_item': item,
+                } for n, item in enumerate(items)],
+            })
+        else:
+            self.send_json(404, {'name': 'NOT_FOUND'})
+
+    def send_json(self, status, data):
+        body = json.dumps(data)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakePaypalServer(HTTPServer):
+    """
+    A local stand-in for the PayPal Payouts API. Created batches are kept
+    in ``batches`` by payout_batch_id and each item reports the status
+    set for its receiver in ``statuses`` (PENDING otherwise). Duplicate
+    sender_batch_ids are refused as PayPal does, linking to the original
+    batch unless ``link_duplicates`` is off. ``fail_creates`` makes that
+    many batch creations fail with a 500, and ``lose_creates`` that many
+    create the batch but still answer with a 500. Every batch request
+    body is recorded in ``requests``.
+    """
+    def __init__(self, statuses=None, fail_creates=0, lose_creates=0,
+                 link_duplicates=True):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), FakePaypalHandler)
+        self.statuses = statuses or {}
+        self.fail_creates = fail_creates
+        self.lose_creates = lose_creates
+        self.link_duplicates = link_duplicates
+        self.batches = {}
+        # sender_batch_id: payout_batch_id
+        self.sender_batch_ids = {}
+        self.requests = []
+        self.base_url = 'http://127.0.0.1:%s' % self.server_port
+        self.thread = threading.Thread(target=self.serve_forever,
+                                       args=(0.01,))
+        self.thread.daemon = True
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,31 @@
+from decimal import Decimal
+
+from django.test import TestCase
+
+from ..fees import offer_fees, payout_fees, roundup_penny
+
+
+class FeesTest(TestCase):
+    def test_roundup_penny(self):
+        self.assertEqual(Decimal('0.01'), roundup_penny(Decimal('0.001')))
+        self.assertEqual(Decimal('1.25'), roundup_penny(Decimal('1.25')))
+        self.assertEqual(Decimal('8.33'), roundup_penny(Decimal('8.325')))
+
+    def test_offer_fees(self):
+        schedule = offer_fees(333)
+        self.assertEqual([('codesy', Decimal('8.33')),
+                          ('Stripe', Decimal('10.51'))], schedule.fees)
+        self.assertEqual(Decimal('351.84'), schedule.charge_amount)
+
+    def test_offer_charge_covers_amount_and_fees(self):
+        for amount in [333, 22, 357, 1000, 50, 999, 1]:
+            schedule = offer_fees(amount)
+            self.assertEqual(
+                amount, schedule.charge_amount -
+                sum(fee for fee_type, fee in schedule.fees))
+
+    def test_payout_fees(self):
+        schedule = payout_fees(50)
+        self.assertEqual([('PayPal', Decimal('0.25')),
+                          ('codesy', Decimal('1.25'))], schedule.fees)
+        self.assertEqual(Decimal('48.50'), schedule.charge_amount)
@@ -0,0 +1,105 @@
+import paypalrestsdk
+
+from django.conf import settings
+from django.test import TestCase
+
+from model_mommy import mommy
+
+from ..models import Bid, Claim, Issue, Payout
+from ..payouts import poll_payout_batches, send_payout_batches
+from .fake_paypal import FakePaypalServer
+
+
+class PayoutBatchTest(TestCase):
+    def setUp(self):
+        url = 'http://github.com/codesy/codesy/issues/37'
+        issue = mommy.make(Issue, url=url)
+        self.claims = []
+        for n in range(1, 4):
+            user = mommy.make(settings.AUTH_USER_MODEL,
+                              email='user%s@test.com' % n)
+            mommy.make(Bid, user=user, url=url, issue=issue, ask=50)
+            claim = mommy.make(Claim, user=user, issue=issue)
+            claim.payout_request()
+            self.claims.append(claim)
+
+    def api(self, server):
+        return paypalrestsdk.Api(mode='sandbox', client_id='id',
+                                 client_secret='secret',
+                                 endpoint=server.base_url)
+
+    def test_queued_payouts_go_in_one_batch(self):
+        with FakePaypalServer() as server:
+            self.assertEqual(1, send_payout_batches(api=self.api(server)))
+            self.assertEqual(0, send_payout_batches(api=self.api(server)))
+        self.assertEqual(1, len(server.requests))
+        self.assertEqual(
+            ['user1@test.com', 'user2@test.com', 'user3@test.com'],
+            [item['receiver'] for item in server.requests[0]['items']])
+        self.assertEqual('48.50',
+                         server.requests[0]['items'][0]['amount']['value'])
+        self.assertEqual(set(['BATCH1']),
+                         set(Payout.objects.values_list('batch_id',
+                                                        flat=True)))
+
+    def test_batch_size(self):
+        with FakePaypalServer() as server:
+            self.assertEqual(2, send_payout_batches(api=self.api(server),
+                                                    batch_size=2))
+        self.assertEqual([2, 1], [len(request['items'])
+                                  for request in server.requests])
+
+    def test_poll_marks_payouts_and_claims(self):
+        statuses = {'user1@test.com': 'SUCCESS',
+                    'user2@test.com': 'FAILED'}
+        with FakePaypalServer(statuses=statuses) as server:
+            send_payout_batches(api=self.api(server))
+            self.assertEqual((1, 1), poll_payout_batches(api=self.api(server)))
+
+            self.assertEqual('Paid', Claim.objects.get(
+                id=self.claims[0].id).status)
+            paid = Payout.objects.get(claim=self.claims[0])
+            self.assertTrue(paid.api_success)
+            self.assertEqual('BATCH1-ITEM0', paid.confirmation)
+            self.assertEqual('PayPal item FAILED', Payout.objects.get(
+                claim=self.claims[1]).error_message)
+            self.assertNotEqual('Paid', Claim.objects.get(
+                id=self.claims[2].id).status)
+
+            statuses['user3@test.com'] = 'SUCCESS'
+            self.assertEqual((1, 0), poll_payout_batches(api=self.api(server)))
+        self.assertEqual('Paid', Claim.objects.get(id=self.claims[2].id)
+                                              .status)
+
+    def test_unaccepted_batch_is_resent_under_the_same_id(self):
+        with FakePaypalServer(fail_creates=1) as server:
+            self.assertEqual(0, send_payout_batches(api=self.api(server)))
+            self.assertFalse(Payout.objects.exclude(batch_id='').exists())
+            self.assertEqual(1, send_payout_batches(api=self.api(server)))
+        self.assertEqual(
+            server.requests[0]['sender_batch_header']['sender_batch_id'],
+            server.requests[1]['sender_batch_header']['sender_batch_id'])
+
+    def test_lost_create_reply_records_the_existing_batch(self):
+        statuses = {'user1@test.com': 'SUCCESS'}
+        with FakePaypalServer(statuses=statuses, lose_creates=1) as server:
+            self.assertEqual(0, send_payout_batches(api=self.api(server)))
+            self.assertEqual(1, send_payout_batches(api=self.api(server)))
+            self.assertEqual(set(['BATCH1']),
+                             set(Payout.objects.values_list('batch_id',
+                                                            flat=True)))
+            self.assertEqual((1, 0), poll_payout_batches(api=self.api(server)))
+        self.assertEqual(1, len(server.batches))
+
+    def test_refused_batch_frees_claims_for_another_payout(self):
+        with FakePaypalServer(lose_creates=1,
+                              link_duplicates=False) as server:
+            send_payout_batches(api=self.api(server))
+            self.assertEqual(0, send_payout_batches(api=self.api(server)))
+        self.assertEqual(set(['PayPal refused batch: Batch with given '
+                              'sender_batch_id already exists']),
+                         set(Payout.objects.values_list('error_message',
+                                                        flat=True)))
+        self.claims[0].payout_request()
+        self.assertEqual(2, Payout.objects.filter(claim=self.claims[0])
+                                          .count())
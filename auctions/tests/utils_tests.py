@@ -1,30 +1,540 @@
+import socket
+import time
+from datetime import timedelta
+from StringIO import StringIO
+
 import fudge
+import requests
 
+from django.conf import settings
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from github import Github
+from mailer.models import Message
+from model_mommy import mommy
+
+from ..models import (Bid, Claim, Issue, Offer, OfferPaymentJob,
+                      OfferTotal, PageTitle, TitleFetchJob)
+from ..utils import (IssueStateRefresher, bulk_create_new, fetch_titles,
+                     issue_ids_for_urls, process_offer_payments, save_bids,
+                     sync_repo_issue_states, update_bid_issues)
+from .fake_github import FakeGithubServer
+
+
+class FetchTitlesTest(TestCase):
+    def setUp(self):
+        self.url = 'https://github.com/codesy/codesy/issues/158'
+        self.bid = mommy.make(Bid, url=self.url)
+
+    def _fake_session(self, get):
+        return fudge.Fake('session').provides('get').calls(get)
+
+    def _response(self, status_code=200, text='', headers=None):
+        return (fudge.Fake().provides('raise_for_status')
+                .has_attr(status_code=status_code, text=text,
+                          headers=headers or {}))
+
+    def test_fetch_titles_saves_title_and_clears_job(self):
+        def get(url, headers, timeout):
+            self.assertEqual({}, headers)
+            return self._response(
+                text='<title>Howdy &amp; Dammit</title>',
+                headers={'ETag': '"abc"'})
+
+        self.assertEqual(1, fetch_titles(session=self._fake_session(get)))
+
+        self.assertEqual(u'Howdy & Dammit',
+                         Bid.objects.get(pk=self.bid.pk).title)
+        self.assertEqual(u'Howdy & Dammit',
+                         Issue.objects.get(url=self.url).title)
+        self.assertFalse(TitleFetchJob.objects.exists())
+        page = PageTitle.objects.get(url=self.url)
+        self.assertEqual('"abc"', page.etag)
+        self.assertTrue(page.is_fresh())
+
+    def test_fetch_titles_revalidates_stale_cache(self):
+        PageTitle.objects.create(
+            url=self.url, title='Cached', etag='"abc"',
+            last_modified='Mon, 17 Oct 2016 00:00:00 GMT',
+            fetched=timezone.now() - PageTitle.FRESH_FOR)
+
+        def get(url, headers, timeout):
+            self.assertEqual('"abc"', headers['If-None-Match'])
+            self.assertEqual('Mon, 17 Oct 2016 00:00:00 GMT',
+                             headers['If-Modified-Since'])
+            return self._response(status_code=304)
+
+        fetch_titles(session=self._fake_session(get))
+
+        page = PageTitle.objects.get(url=self.url)
+        self.assertEqual('Cached', page.title)
+        self.assertTrue(page.is_fresh())
+        self.assertEqual('Cached', Bid.objects.get(pk=self.bid.pk).title)
+
+    def test_fetch_titles_backs_off_on_error(self):
+        def get(url, headers, timeout):
+            raise requests.Timeout('slow')
+
+        fetch_titles(session=self._fake_session(get))
+
+        job = TitleFetchJob.objects.get(url=self.url)
+        self.assertEqual(1, job.attempts)
+        self.assertTrue(job.next_attempt > timezone.now())
+        self.assertEqual('slow', job.last_error)
+        # not due yet, so the next run leaves it alone
+        self.assertEqual(0, fetch_titles(session=self._fake_session(get)))
+        self.assertEqual(1, TitleFetchJob.objects.get(url=self.url).attempts)
+
+    def test_fetch_titles_gives_up_after_max_attempts(self):
+        def get(url, headers, timeout):
+            raise requests.ConnectionError('down')
+
+        TitleFetchJob.objects.filter(url=self.url).update(
+            attempts=TitleFetchJob.MAX_ATTEMPTS - 1)
+
+        fetch_titles(session=self._fake_session(get))
+
+        self.assertFalse(TitleFetchJob.objects.filter(url=self.url).exists())
+
+
+class IssueStateRefresherTest(TestCase):
+    def setUp(self):
+        self.issues = [
+            mommy.make(Issue, state='unknown',
+                       url='https://github.com/codesy/codesy/issues/%s' % n)
+            for n in (1, 2, 3)
+        ]
+        self.other_issue = mommy.make(
+            Issue, state='unknown',
+            url='https://github.com/mozilla/bedrock/issues/4')
+        self.listing = {
+            'codesy/codesy': [
+                {'number': 1, 'state': 'open'},
+                {'number': 2, 'state': 'closed'},
+                {'number': 3, 'state': 'open'},
+            ],
+            'mozilla/bedrock': [
+                {'number': 4, 'state': 'closed'},
+            ],
+        }
+
+    def _issue(self, issue):
+        return Issue.objects.get(pk=issue.pk)
+
+    def test_refresh_saves_states(self):
+        with FakeGithubServer(self.listing) as server:
+            refresher = IssueStateRefresher(
+                Github(base_url=server.base_url), workers=3)
+            self.assertEqual(4, refresher.refresh(Issue.objects.all()))
+        self.assertEqual(
+            ['open', 'closed', 'open', 'closed'],
+            [self._issue(issue).state
+             for issue in self.issues + [self.other_issue]]
+        )
+        self.assertEqual('"2-closed"', self._issue(self.issues[1]).etag)
+
+    def test_refresh_skips_failed_lookups(self):
+        with FakeGithubServer(self.listing) as server:
+            gh_client = Github(base_url=server.base_url)
+            get_repo = gh_client.get_repo
+
+            def flaky_get_repo(name):
+                if name == 'mozilla/bedrock':
+                    raise socket.timeout('timed out')
+                return get_repo(name)
+            gh_client.get_repo = flaky_get_repo
+            refresher = IssueStateRefresher(gh_client, workers=1)
+            with fudge.patched_context('auctions.utils', 'logger',
+                                       fudge.Fake().is_a_stub()):
+                self.assertEqual(4, refresher.refresh(
+                    Issue.objects.order_by('-id')))
+        self.assertEqual(1, refresher.failed)
+        self.assertEqual('unknown', self._issue(self.other_issue).state)
+        self.assertEqual(['open', 'closed', 'open'],
+                         [self._issue(issue).state for issue in self.issues])
+
+    def test_refresh_falls_back_without_private_requester(self):
+        class ChangedRequester(object):
+            def __init__(self, requester):
+                self.requester = requester
+
+            def requestJson(self, *args, **kwargs):
+                raise TypeError("requestJson() got an unexpected keyword "
+                                "argument 'headers'")
+
+            def __getattr__(self, name):
+                return getattr(self.requester, name)
+
+        with FakeGithubServer(self.listing) as server:
+            gh_client = Github(base_url=server.base_url)
+            get_repo = gh_client.get_repo
+
+            def changed_get_repo(name):
+                repo = get_repo(name)
+                repo._requester = ChangedRequester(repo._requester)
+                return repo
+            gh_client.get_repo = changed_get_repo
+            refresher = IssueStateRefresher(gh_client)
+            refresher.refresh(Issue.objects.all())
+        self.assertEqual(0, refresher.failed)
+        self.assertEqual('closed', self._issue(self.issues[1]).state)
+        self.assertEqual('"2-closed"', self._issue(self.issues[1]).etag)
+
+    def test_refresh_logs_and_counts_missing_issues(self):
+        del self.listing['mozilla/bedrock'][0]
+        warnings = []
+        logger = fudge.Fake().provides('warning').calls(
+            lambda *args: warnings.append(args))
+        with FakeGithubServer(self.listing) as server:
+            refresher = IssueStateRefresher(Github(base_url=server.base_url))
+            with fudge.patched_context('auctions.utils', 'logger', logger):
+                refresher.refresh(Issue.objects.all())
+        self.assertEqual(1, refresher.failed)
+        self.assertEqual([("GitHub answered %s for %s", 404,
+                           self.other_issue.url)], warnings)
+
+    def test_refresh_memoizes_repos(self):
+        with FakeGithubServer(self.listing) as server:
+            gh_client = Github(base_url=server.base_url)
+            repos_fetched = []
+            get_repo = gh_client.get_repo
+            gh_client.get_repo = (
+                lambda name: repos_fetched.append(name) or get_repo(name))
+            IssueStateRefresher(gh_client).refresh(Issue.objects.all())
+        self.assertEqual(['codesy/codesy', 'mozilla/bedrock'],
+                         sorted(repos_fetched))
+
+    def test_refresh_stops_at_budget(self):
+        with FakeGithubServer(self.listing) as server:
+            refresher = IssueStateRefresher(
+                Github(base_url=server.base_url), budget=2)
+            self.assertEqual(2,
+                             refresher.refresh(Issue.objects.order_by('id')))
+        self.assertEqual('unknown', self._issue(self.other_issue).state)
+
+    def test_refresh_waits_for_rate_limit_reset(self):
+        reset = int(time.time()) + 60
+        sleeps = []
+        with FakeGithubServer(self.listing,
+                              rate_limit=(3, reset)) as server:
+            refresher = IssueStateRefresher(
+                Github(base_url=server.base_url), workers=1,
+                sleep=sleeps.append)
+            refresher.refresh(Issue.objects.all())
+        self.assertEqual(4, len(sleeps))
+        self.assertTrue(all(55 < delay <= 61 for delay in sleeps))
+
+    def test_refresh_sends_conditional_requests(self):
+        with FakeGithubServer(self.listing) as server:
+            gh_client = Github(base_url=server.base_url)
+            IssueStateRefresher(gh_client).refresh(Issue.objects.all())
+            self.listing['codesy/codesy'][0]['state'] = 'closed'
+            Issue.objects.update(last_fetched=timezone.now() -
+                                 timedelta(days=2))
+            refresher = IssueStateRefresher(gh_client)
+            refresher.refresh(Issue.objects.all())
+        self.assertEqual(3, refresher.not_modified)
+        self.assertEqual(1, refresher.modified)
+        self.assertEqual('closed', self._issue(self.issues[0]).state)
+        self.assertFalse(Issue.objects.filter(
+            last_fetched__lt=timezone.now() - timedelta(days=1)).exists())
+        self.assertEqual('"2-closed"', dict(
+            (path, headers) for path, params, headers in server.requests
+        )['/repos/codesy/codesy/issues/2']['if-none-match'])
+
+
+class SyncRepoIssueStatesTest(TestCase):
+    def setUp(self):
+        self.last_fetched = timezone.now() - timedelta(days=2)
+        self.issues = {}
+        for repo_name, number in [('codesy/codesy', 1),
+                                  ('codesy/codesy', 2),
+                                  ('codesy/codesy', 3),
+                                  ('mozilla/bedrock', 4)]:
+            url = 'https://github.com/%s/issues/%s' % (repo_name, number)
+            self.issues[number] = mommy.make(Issue, url=url, state='open')
+        self.unknown = mommy.make(
+            Issue, state='unknown',
+            url='https://github.com/codesy/codesy/issues/5')
+        Issue.objects.update(last_fetched=self.last_fetched)
+        self.listing = {
+            'codesy/codesy': [
+                {'number': 1, 'state': 'closed',
+                 'updated_at': '2999-01-01T00:00:00Z'},
+                {'number': 2, 'state': 'open',
+                 'updated_at': '2999-01-01T00:00:00Z'},
+                {'number': 99, 'state': 'closed',
+                 'updated_at': '2999-01-01T00:00:00Z'},
+                {'number': 3, 'state': 'closed',
+                 'updated_at': '2000-01-01T00:00:00Z'},
+            ],
+            'mozilla/bedrock': [
+                {'number': 4, 'state': 'closed',
+                 'updated_at': '2999-01-01T00:00:00Z'},
+            ],
+        }
+
+    def _sync(self, server):
+        gh_client = Github(base_url=server.base_url, per_page=2)
+        return sync_repo_issue_states(Issue.objects.all(),
+                                      IssueStateRefresher(gh_client))
+
+    def _state(self, number):
+        return Issue.objects.get(pk=self.issues[number].pk).state
+
+    def test_sync_applies_changed_states(self):
+        with FakeGithubServer(self.listing) as server:
+            self._sync(server)
+        self.assertEqual('closed', self._state(1))
+        self.assertEqual('open', self._state(2))
+        # not updated since the last sync, so not in the listing
+        self.assertEqual('open', self._state(3))
+        self.assertEqual('closed', self._state(4))
+        self.assertFalse(
+            Issue.objects.exclude(pk=self.unknown.pk)
+                         .filter(last_fetched=self.last_fetched).exists())
+
+    def test_sync_pages_each_repo_listing_once(self):
+        with FakeGithubServer(self.listing) as server:
+            self._sync(server)
+        listings = [(path, params) for path, params, headers
+                    in server.requests if path != '/rate_limit']
+        # codesy/codesy has 3 matching issues at 2 per page
+        self.assertEqual(['/repos/codesy/codesy/issues'] * 2 +
+                         ['/repos/mozilla/bedrock/issues'],
+                         sorted(path for path, params in listings))
+        for path, params in listings:
+            self.assertEqual('all', params['state'])
+            self.assertEqual(
+                self.last_fetched.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                params['since'])
+
+    def test_sync_uses_one_update_per_repo(self):
+        with FakeGithubServer(self.listing) as server:
+            with CaptureQueriesContext(connection) as queries:
+                self._sync(server)
+        updates = [q['sql'] for q in queries.captured_queries
+                   if q['sql'].startswith('UPDATE')]
+        self.assertEqual(2, len(updates))
+
+    def test_sync_logs_and_reports_missing_repos(self):
+        del self.listing['mozilla/bedrock']
+        stdout = StringIO()
+        logger = fudge.Fake().expects('warning').with_args(
+            "GitHub repository %s not found", 'mozilla/bedrock')
+        with FakeGithubServer(self.listing) as server:
+            with fudge.patched_context('auctions.utils', 'logger', logger):
+                sync_repo_issue_states(
+                    Issue.objects.all(),
+                    IssueStateRefresher(Github(base_url=server.base_url)),
+                    stdout=stdout)
+        self.assertEqual("Synced 1 repositories (1 not found, 0 failed)",
+                         stdout.getvalue())
+        self.assertEqual('open', self._state(4))
+
+    def test_sync_falls_back_when_a_listing_fails(self):
+        self.listing['mozilla/bedrock'] = 502
+        stdout = StringIO()
+        logger = fudge.Fake().expects('exception').with_args(
+            "Listing the issues of %s failed", 'mozilla/bedrock')
+        with FakeGithubServer(self.listing) as server:
+            with fudge.patched_context('auctions.utils', 'logger', logger):
+                leftovers = sync_repo_issue_states(
+                    Issue.objects.all(),
+                    IssueStateRefresher(Github(base_url=server.base_url)),
+                    stdout=stdout)
+        self.assertEqual("Synced 1 repositories (0 not found, 1 failed)",
+                         stdout.getvalue())
+        self.assertEqual('closed', self._state(1))
+        self.assertEqual(set([self.unknown, self.issues[4]]), set(leftovers))
+
+    def test_sync_waits_for_rate_limit_reset(self):
+        reset = int(time.time()) + 60
+        sleeps = []
+        with FakeGithubServer(self.listing,
+                              rate_limit=(3, reset)) as server:
+            refresher = IssueStateRefresher(
+                Github(base_url=server.base_url, per_page=2),
+                sleep=sleeps.append)
+            sync_repo_issue_states(Issue.objects.all(), refresher)
+        # one wait before each of the three listing pages
+        self.assertEqual(3, len(sleeps))
+        self.assertEqual('closed', self._state(4))
+
+    def test_sync_leaves_unknown_issues_for_lookup(self):
+        with FakeGithubServer(self.listing) as server:
+            leftovers = self._sync(server)
+        self.assertEqual([self.unknown], leftovers)
+        self.assertEqual('unknown',
+                         Issue.objects.get(pk=self.unknown.pk).state)
+
+
+class BulkCreateNewTest(TestCase):
+    def test_skips_rows_that_already_exist(self):
+        mommy.make(Issue, url='http://gh.com/1')
+        created = bulk_create_new(Issue, [Issue(url='http://gh.com/%s' % n)
+                                          for n in (1, 2)])
+        self.assertEqual(['http://gh.com/2'], [i.url for i in created])
+        self.assertEqual(2, Issue.objects.count())
+
+
+class UpdateBidIssuesTest(TestCase):
+    def setUp(self):
+        self.urls = ['https://github.com/codesy/codesy/issues/%s' % n
+                     for n in range(1, 6)]
+        self.existing_issue = mommy.make(Issue, url=self.urls[0])
+        for url in self.urls:
+            mommy.make(Bid, url=url)
+            mommy.make(Bid, url=url)
+        Bid.objects.update(issue=None)
+        Issue.objects.exclude(pk=self.existing_issue.pk).delete()
+        TitleFetchJob.objects.all().delete()
+
+    def test_links_orphan_bids(self):
+        self.assertEqual(10, update_bid_issues(chunk_size=2))
+        self.assertFalse(Bid.objects.filter(issue=None).exists())
+        for bid in Bid.objects.select_related('issue'):
+            self.assertEqual(bid.url, bid.issue.url)
+        self.assertEqual(5, Issue.objects.count())
+        self.assertEqual(
+            self.existing_issue,
+            Bid.objects.filter(url=self.urls[0])[0].issue)
+        self.assertEqual(4, TitleFetchJob.objects.count())
+
+    def test_queries_per_chunk_are_constant(self):
+        # urls, issues, create issues, new issue ids, queued titles,
+        # create title jobs, link bids; then the final empty urls query.
+        # Both creates run in a savepoint, to recover from a concurrent
+        # insert
+        with self.assertNumQueries(12):
+            update_bid_issues(chunk_size=10)
+
+    def test_reports_progress(self):
+        stdout = StringIO()
+        update_bid_issues(chunk_size=3, stdout=stdout)
+        self.assertEqual(
+            "Linked 6 bids on 3 urls (2 new issues)"
+            "Linked 4 bids on 2 urls (2 new issues)",
+            stdout.getvalue())
+
+
+class ProcessOfferPaymentsTest(TestCase):
+    def setUp(self):
+        self.url = 'http://github.com/codesy/codesy/issues/37'
+        self.bid = mommy.make(Bid, url=self.url, offer=10)
+        self.offer = mommy.make(Offer, user=self.bid.user, bid=self.bid,
+                                amount=5)
+        OfferPaymentJob.objects.create(offer=self.offer, bid_offer=15)
+
+    def test_success_updates_bid_offer(self):
+        self.assertEqual(1, process_offer_payments())
+        self.assertEqual(15, Bid.objects.get(pk=self.bid.pk).offer)
+        self.assertTrue(Offer.objects.get(pk=self.offer.pk).api_success)
+        self.assertFalse(OfferPaymentJob.objects.exists())
+
+    def test_success_keeps_bid_edits_made_during_charge(self):
+        request = Offer.request
+
+        def edit_during_charge(offer):
+            charged = request(offer)
+            Bid.objects.filter(pk=self.bid.pk).update(ask=99)
+            return charged
 
-from github import UnknownObjectException
+        with fudge.patched_context(Offer, 'request', edit_during_charge):
+            process_offer_payments()
+        bid = Bid.objects.get(pk=self.bid.pk)
+        self.assertEqual((99, 15), (bid.ask, bid.offer))
 
-from ..utils import issue_state
+    def test_failure_leaves_bid_offer(self):
+        declined = (fudge.Fake().provides('create')
+                    .raises(Exception('Your card was declined.')))
+        with fudge.patched_context('auctions.models.stripe', 'Charge',
+                                   declined):
+            self.assertEqual(0, process_offer_payments())
+        self.assertEqual(10, Bid.objects.get(pk=self.bid.pk).offer)
+        offer = Offer.objects.get(pk=self.offer.pk)
+        self.assertEqual('failed', offer.payment_status())
+        self.assertFalse(OfferPaymentJob.objects.exists())
 
 
-class IssueStateTest(TestCase):
+class SaveBidsTest(TestCase):
+    def setUp(self):
+        self.user = mommy.make(settings.AUTH_USER_MODEL,
+                               email='user1@test.com')
+        self.other = mommy.make(settings.AUTH_USER_MODEL,
+                                email='user2@test.com')
+        self.url = 'http://github.com/codesy/codesy/issues/%s'
+        self.bid = mommy.make(Bid, user=self.user, url=self.url % 1,
+                              ask=100, offer=5)
 
-    def test_issue_state(self):
-        url = 'https://github.com/codesy/codesy/issues/158'
+    def test_creates_and_updates(self):
+        results = save_bids(self.user, [
+            {'url': self.url % 1, 'offer': 20},
+            {'url': self.url % 2, 'ask': 30},
+        ])
+        self.assertEqual([(self.bid.id, False), (Bid.objects.get(
+            url=self.url % 2).id, True)],
+            [(bid.id, created) for bid, created in results])
+        bid1, bid2 = [bid for bid, created in results]
+        self.assertEqual((100, 20), (bid1.ask, bid1.offer))
+        self.assertEqual((30, 0), (bid2.ask, bid2.offer))
+        self.assertEqual(Issue.objects.get(url=self.url % 2), bid2.issue)
+        self.assertIsNotNone(bid2.created)
+        self.assertEqual(20, OfferTotal.objects.get(url=self.url % 1).offer)
+        self.assertTrue(TitleFetchJob.objects.filter(url=self.url % 2)
+                                             .exists())
 
-        fake_gh_client = fudge.Fake()
-        (fake_gh_client.expects('get_repo').with_args('codesy/codesy')
-                       .returns_fake().expects('get_issue').with_args(158)
-                       .returns_fake().has_attr(state='open'))
+    def test_later_items_override_earlier(self):
+        results = save_bids(self.user, [
+            {'url': self.url % 3, 'ask': 5, 'offer': 1},
+            {'url': self.url % 3, 'offer': 2},
+        ])
+        self.assertEqual(1, Issue.objects.filter(url=self.url % 3).count())
+        self.assertEqual(1, Bid.objects.filter(url=self.url % 3).count())
+        bid = Bid.objects.get(url=self.url % 3)
+        self.assertEqual((5, 2), (bid.ask, bid.offer))
+        self.assertEqual([True, True], [created for b, created in results])
 
-        self.assertEqual('open', issue_state(url, fake_gh_client))
+    def test_ask_match_and_claim_voters_once_per_url(self):
+        mommy.make(Bid, user=self.other, url=self.url % 1, ask=0,
+                   offer=50)
+        claim = mommy.make(Claim, user=self.other, issue=self.bid.issue)
+        queued = Message.objects.count()
+        save_bids(self.user, [
+            {'url': self.url % 1, 'ask': 40},
+            {'url': self.url % 1, 'ask': 30, 'offer': 10},
+        ])
+        self.assertEqual(queued + 1, Message.objects.count())
+        self.assertIsNotNone(Bid.objects.get(pk=self.bid.pk).ask_match_sent)
+        self.assertEqual(1, Claim.objects.get(pk=claim.pk).eligible_voters)
 
-    def test_issue_state_catches_UnknownObjectException(self):
-        url = 'https://github.com/codesy/codesy/issues/158'
+    def test_bids_created_concurrently_are_updated(self):
+        def racing_issue_ids(urls):
+            result = issue_ids_for_urls(urls)
+            # another request creates the bid before this one inserts it
+            Bid.objects.bulk_create([Bid(user=self.user, url=self.url % 2,
+                                         issue_id=result[0][self.url % 2],
+                                         offer=1)])
+            return result
 
-        fake_gh_client = fudge.Fake()
-        (fake_gh_client.expects('get_repo').with_args('codesy/codesy')
-                       .raises(UnknownObjectException(404,
-                                                      "Cannot find repo.")))
+        with fudge.patched_context('auctions.utils', 'issue_ids_for_urls',
+                                   racing_issue_ids):
+            results = save_bids(self.user, [
+                {'url': self.url % 2, 'offer': 20},
+                {'url': self.url % 3, 'offer': 30},
+            ])
+        self.assertEqual([(self.url % 2, 20, False), (self.url % 3, 30, True)],
+                         [(bid.url, bid.offer, created)
+                          for bid, created in results])
+        self.assertEqual(1, Bid.objects.filter(url=self.url % 2).count())
 
-        self.assertEqual(None, issue_state(url, fake_gh_client))
+    def test_repeated_urls_cost_no_queries(self):
+        def count(urls):
+            with CaptureQueriesContext(connection) as queries:
+                save_bids(self.user, [{'url': self.url % i, 'offer': 1}
+                                      for i in urls])
+            return len(queries)
+        self.assertEqual(count([100, 101]), count([200, 201, 200, 201]))
@@ -1,11 +1,24 @@
+from decimal import Decimal
+
+import json
+
 import fudge
 
 from django.conf import settings
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 
 from model_mommy import mommy
 
-from ..models import Issue, Bid, Claim, Vote
+from codesy import invalidation
+
+from ..models import Issue, Bid, Claim, Offer, OfferFee, OfferPaymentJob
+from ..models import Vote
+from ..models import market_tag
+from ..utils import process_offer_payments
 from ..views import BidStatusView, ClaimStatusView
 from ..views import BidList, ClaimList, VoteList
 
@@ -27,20 +40,198 @@ class BidStatusTestCase(TestCase):
         context = self.view.get_context_data()
         self.assertEqual(self.bid1, context['bid'])
 
-    @fudge.patch('auctions.views.messages')
-    def test_post_new_offer(self, mock_messages):
-        mock_messages.is_a_stub()
+    def test_get_builds_widget_state_in_two_queries(self):
+        user2 = mommy.make(settings.AUTH_USER_MODEL, email='user2@test.com')
+        Bid.objects.filter(pk=self.bid1.pk).update(ask=10)
+        mommy.make(Bid, user=user2, url=self.url, issue=self.issue, offer=20)
+        claim = mommy.make(Claim, user=user2, issue=self.issue,
+                           evidence='http://github.com/codesy/codesy/pull/1')
+        self.view.request = (fudge.Fake()
+                             .has_attr(GET={'url': self.url})
+                             .has_attr(user=self.user1))
+        with self.assertNumQueries(2):
+            widget = self.view.get_context_data()['widget']
+            self.assertTrue(widget['ask_met'])
+            self.assertEqual(20, widget['offer_total'])
+            self.assertEqual(None, widget['own_claim'])
+            self.assertEqual([claim], widget['other_claims'])
+            self.assertFalse(widget['biddable'])
+
+    def test_get_without_bid_has_no_widget_state(self):
+        self.view.request = (fudge.Fake()
+                             .has_attr(GET={'url': self.url + '0'})
+                             .has_attr(user=self.user1))
+        context = self.view.get_context_data()
+        self.assertEqual(None, context['bid'])
+        self.assertEqual(None, context['widget'])
+
+    def post_offer(self, offer):
         self.view.request = (fudge.Fake().has_attr(
             POST={
                 'url': self.url,
                 'ask': 0,
-                'offer': 44,
+                'offer': offer,
             })
             .has_attr(user=self.user1))
-        self.view.post()
+        return self.view.post()
+
+    @fudge.patch('auctions.views.messages')
+    def test_post_new_offer(self, mock_messages):
+        mock_messages.is_a_stub()
+        self.post_offer(44)
+        process_offer_payments()
         retreive_bid = Bid.objects.get(pk=self.bid1.id)
         self.assertEqual(retreive_bid.offer, 44)
 
+    @fudge.patch('auctions.models.Offer.request')
+    def test_post_new_offer_queues_payment(self, mock_request):
+        mock_request.is_callable().times_called(0)
+        response = self.post_offer(44)
+        job = OfferPaymentJob.objects.get(offer__bid=self.bid1)
+        self.assertEqual(44, job.bid_offer)
+        self.assertEqual(0, Bid.objects.get(pk=self.bid1.id).offer)
+        self.assertTrue(
+            response['Location'].endswith('&offer=%s' % job.offer_id))
+
+    @fudge.patch('auctions.views.messages')
+    def test_post_while_offer_is_processing(self, mock_messages):
+        mock_messages.expects('error')
+        self.post_offer(44)
+        self.post_offer(55)
+        self.assertEqual(1, Offer.objects.filter(bid=self.bid1).count())
+
+    def get_offer_context(self, offer_id):
+        self.view.request = (fudge.Fake()
+                             .has_attr(GET={'url': self.url,
+                                            'offer': offer_id})
+                             .has_attr(user=self.user1))
+        return self.view.get_context_data()
+
+    def test_get_with_offer_has_status_url(self):
+        offer = mommy.make(Offer, user=self.user1, bid=self.bid1, amount=5)
+        context = self.get_offer_context(str(offer.id))
+        self.assertEqual(reverse('offer-status', kwargs={'pk': offer.id}),
+                         context['offer_status_url'])
+        self.assertEqual('pending', context['offer_status']['status'])
+
+    def test_get_with_failed_offer_shows_error(self):
+        offer = mommy.make(Offer, user=self.user1, bid=self.bid1, amount=5,
+                           error_message='Your card was declined.')
+        context = self.get_offer_context(str(offer.id))
+        self.assertEqual('Your card was declined.',
+                         context['offer_status']['message'])
+        self.assertNotIn('offer_status_url', context)
+
+    def test_get_ignores_bad_offer_ids(self):
+        other_offer = mommy.make(Offer, bid=self.bid1, amount=5)
+        for offer_id in ('abc', '7', str(other_offer.id)):
+            context = self.get_offer_context(offer_id)
+            self.assertNotIn('offer_status', context)
+
+
+@override_settings(WIDGET_CACHE=True)
+class BidStatusCacheTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.url = 'http://github.com/codesy/codesy/issues/37'
+        self.issue = mommy.make(Issue, url=self.url)
+        self.user1 = mommy.make(settings.AUTH_USER_MODEL,
+                                email='user1@test.com')
+        self.user2 = mommy.make(settings.AUTH_USER_MODEL,
+                                email='user2@test.com')
+        mommy.make(Bid, user=self.user1, url=self.url, issue=self.issue,
+                   offer=10)
+        self.client.force_login(self.user1)
+
+    def get_widget(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('bid-status'),
+                                       {'url': self.url})
+        self.assertEqual(200, response.status_code)
+        market_queries = [q for q in queries
+                          if 'auctions_' in q['sql']]
+        return response, market_queries
+
+    def test_repeat_view_is_cached(self):
+        first, queries = self.get_widget()
+        self.assertTrue(queries)
+        second, queries = self.get_widget()
+        self.assertEqual([], queries)
+        self.assertEqual(first.content, second.content)
+
+    def test_off_without_widget_cache(self):
+        with self.settings(WIDGET_CACHE=False):
+            self.get_widget()
+            response, queries = self.get_widget()
+        self.assertTrue(queries)
+
+    def test_new_claim_invalidates(self):
+        response, queries = self.get_widget()
+        self.assertNotContains(response, 'Vote on claim')
+        mommy.make(Claim, user=self.user2, issue=self.issue)
+        response, queries = self.get_widget()
+        self.assertContains(response, 'Vote on claim')
+
+    def test_vote_invalidates(self):
+        claim = mommy.make(Claim, user=self.user2, issue=self.issue)
+        self.get_widget()
+        mommy.make(Vote, user=self.user1, claim=claim, approved=True)
+        response, queries = self.get_widget()
+        self.assertContains(response, 'This claim was approved')
+
+    def test_evicted_version_rerenders(self):
+        self.get_widget()
+        cache.delete(invalidation.tag_key(market_tag(self.url)))
+        response, queries = self.get_widget()
+        self.assertTrue(queries)
+
+    def test_offer_progress_is_not_cached(self):
+        self.get_widget()
+        offer = mommy.make(Offer, user=self.user1,
+                           bid=Bid.objects.get(user=self.user1), amount=5)
+        response = self.client.get(reverse('bid-status'),
+                                   {'url': self.url, 'offer': offer.id})
+        self.assertContains(response, 'offer-status')
+        response, queries = self.get_widget()
+        self.assertNotContains(response, 'offer-status')
+
+
+class OfferStatusTestCase(TestCase):
+    def setUp(self):
+        self.url = 'http://github.com/codesy/codesy/issues/37'
+        self.user1 = mommy.make(settings.AUTH_USER_MODEL,
+                                email='user1@test.com')
+        self.user2 = mommy.make(settings.AUTH_USER_MODEL,
+                                email='user2@test.com')
+        self.bid = mommy.make(Bid, user=self.user1, url=self.url)
+        self.offer = mommy.make(Offer, user=self.user1, bid=self.bid,
+                                amount=10)
+
+    def get_status(self, user=None):
+        self.client.force_login(user or self.user1)
+        return self.client.get(reverse('offer-status',
+                                       kwargs={'pk': self.offer.id}))
+
+    def test_pending(self):
+        data = json.loads(self.get_status().content)
+        self.assertEqual('pending', data['status'])
+
+    def test_succeeded(self):
+        Offer.objects.filter(pk=self.offer.pk).update(api_success=True)
+        data = json.loads(self.get_status().content)
+        self.assertEqual('succeeded', data['status'])
+        self.assertEqual("Thanks for the offer!", data['message'])
+
+    def test_failed(self):
+        Offer.objects.filter(pk=self.offer.pk).update(
+            error_message='Your card was declined.')
+        data = json.loads(self.get_status().content)
+        self.assertEqual('failed', data['status'])
+        self.assertEqual('Your card was declined.', data['message'])
+
+    def test_other_users_offer_is_not_found(self):
+        self.assertEqual(404, self.get_status(self.user2).status_code)
+
 
 class ClaimStatusTestCase(TestCase):
     def setUp(self):
@@ -124,6 +315,47 @@ class BidListViewTest(TestCase):
         context = self.view.get_context_data()
         self.assertEqual(0, len(context['bids']))
 
+    def make_bid_rows(self, count):
+        start = Bid.objects.filter(user=self.user1).count()
+        for i in range(start, start + count):
+            url = 'http://github.com/codesy/codesy/issues/%s' % (100 + i)
+            issue = mommy.make(Issue, url=url)
+            bid = mommy.make(Bid, user=self.user1, url=url, issue=issue,
+                             ask=10, offer=5)
+            mommy.make(Bid, user=self.user2, url=url, issue=issue, offer=20)
+            offer = mommy.make(Offer, user=self.user1, bid=bid, amount=5)
+            mommy.make(OfferFee, offer=offer, fee_type='codesy',
+                       amount=Decimal('0.13'))
+            mommy.make(OfferFee, offer=offer, fee_type='Stripe',
+                       amount=Decimal('0.45'))
+            mommy.make(Claim, user=self.user2, issue=issue,
+                       evidence='http://github.com/codesy/codesy/pull/1')
+
+    def count_page_queries(self):
+        self.client.force_login(self.user1)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/bid-list')
+        self.assertEqual(200, response.status_code)
+        return len(queries), response
+
+    def test_bid_list_queries_do_not_grow_with_rows(self):
+        self.make_bid_rows(2)
+        few_queries, response = self.count_page_queries()
+        self.assertContains(response, 'Vote on claim', count=2)
+
+        self.make_bid_rows(6)
+        many_queries, response = self.count_page_queries()
+        self.assertContains(response, 'Vote on claim', count=8)
+        self.assertEqual(few_queries, many_queries)
+
+    def test_bid_list_annotates_ask_met(self):
+        self.make_bid_rows(1)
+        self.view.request = (fudge.Fake()
+                             .has_attr(user=self.user1))
+        bid = self.view.get_context_data()['bids'][0]
+        with self.assertNumQueries(0):
+            self.assertTrue(bid.ask_met())
+
 
 class ClaimListViewTest(TestCase):
     def setUp(self):
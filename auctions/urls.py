@@ -5,6 +5,8 @@ from . import views
 urlpatterns = patterns(
     '',
     url(r'^bid-status/', views.BidStatusView.as_view(), name='bid-status'),
+    url(r'^offer-status/(?P<pk>\d+)',
+        views.OfferStatusView.as_view(), name='offer-status'),
     url(r'^claim-status/(?P<pk>[^/.]+)',
         views.ClaimStatusView.as_view(), name='claim-status'),
     url(r'^bid-list', views.BidList.as_view()),
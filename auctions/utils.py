@@ -1,35 +1,43 @@
+import httplib
+import json
+import logging
 import re
-from datetime import datetime
+import socket
+import threading
+import time
+import HTMLParser
+from collections import OrderedDict, defaultdict
 from datetime import timedelta
+from multiprocessing.pool import ThreadPool
 
-from django.utils import timezone
-
-from decouple import config
-from github import Github, UnknownObjectException
+import requests
+from requests.adapters import HTTPAdapter
 
-from .models import Bid, Issue
+from django.db import IntegrityError, transaction
+from django.db.models import Case, CharField, F, IntegerField, Value, When
+from django.utils import timezone
 
+from github import GithubException, UnknownObjectException
 
-GITHUB_ISSUE_RE = re.compile('https://github.com/(.*)/issues/(\d+)')
+from codesy import github_api, invalidation
 
+from .models import (Bid, Claim, Issue, OfferPaymentJob, OfferTotal,
+                     PageTitle, TitleFetchJob, market_tag, notify_met_asks,
+                     update_eligible_voters)
 
-def github_client():
-    return Github(client_id=config('GITHUB_CLIENT_ID'),
-                  client_secret=config('GITHUB_CLIENT_SECRET'))
 
+GITHUB_ISSUE_RE = re.compile('https://github.com/(.*)/issues/(\d+)')
+TITLE_RE = re.compile('(?:<title.*>)(.*)(?:<\/title>)')
+# (connect, read) seconds
+TITLE_FETCH_TIMEOUT = (3.05, 10)
+BID_ISSUE_CHUNK_SIZE = 500
+ISSUE_STATE_WORKERS = 4
+# stop and wait for the reset when this few GitHub API calls remain
+RATE_LIMIT_RESERVE = 10
+NOT_MODIFIED = object()
+LOOKUP_FAILED = object()
 
-def issue_state(url, gh_client):
-    match = GITHUB_ISSUE_RE.match(url)
-    if match:
-        repo_name, issue_id = match.groups()
-        try:
-            repo = gh_client.get_repo(repo_name)
-            issue = repo.get_issue(int(issue_id))
-        except UnknownObjectException:
-            # TODO: log this exception somewhere
-            pass
-        else:
-            return issue.state
+logger = logging.getLogger(__name__)
 
 
 def update(instance, **kwargs):
@@ -38,21 +46,440 @@ def update(instance, **kwargs):
         using).update(**kwargs)
 
 
-def update_bid_issues():
-    for bid in Bid.objects.filter(issue=None):
+def bulk_create_new(model, objs):
+    """
+    bulk_create objs, skipping any whose unique fields a concurrent
+    transaction inserted first: on an IntegrityError the rows are
+    inserted one savepoint at a time. Returns the objs inserted here.
+    """
+    objs = list(objs)
+    try:
+        with transaction.atomic():
+            model.objects.bulk_create(objs)
+        return objs
+    except IntegrityError:
+        created = []
+        for obj in objs:
+            try:
+                with transaction.atomic():
+                    model.objects.bulk_create([obj])
+            except IntegrityError:
+                continue
+            created.append(obj)
+        return created
+
+
+def issue_ids_for_urls(urls):
+    """
+    Find or create the Issue for each url with one IN query and one bulk
+    INSERT. Returns ({url: issue id}, [urls of new issues]).
+    """
+    issue_ids = dict(Issue.objects.filter(url__in=urls)
+                                  .values_list('url', 'id'))
+    missing = [url for url in urls if url not in issue_ids]
+    if missing:
+        created = bulk_create_new(
+            Issue, (Issue(url=url, state='unknown') for url in missing))
+        # bulk_create doesn't set ids on every backend, and a concurrent
+        # request may have created some of the missing issues
+        issue_ids.update(Issue.objects.filter(url__in=missing)
+                                      .values_list('url', 'id'))
+        missing = [issue.url for issue in created]
+        # bulk_create skips save_title, so queue the titles here
+        queued = set(TitleFetchJob.objects.filter(url__in=missing)
+                                          .values_list('url', flat=True))
+        bulk_create_new(TitleFetchJob, (TitleFetchJob(url=url)
+                                        for url in missing
+                                        if url not in queued))
+    return issue_ids, missing
+
+
+def update_bid_issues(chunk_size=BID_ISSUE_CHUNK_SIZE, stdout=None):
+    """
+    Link every Bid without an issue to the Issue for its url.
+
+    Orphan urls are walked in chunks: existing Issues are found with one
+    IN query, missing ones are bulk created, and the chunk's bids are
+    linked with one UPDATE. Returns the number of bids linked.
+    """
+    linked = 0
+    last_url = ''
+    while True:
+        urls = list(Bid.objects.filter(issue=None, url__gt=last_url)
+                               .order_by('url')
+                               .values_list('url', flat=True)
+                               .distinct()[:chunk_size])
+        if not urls:
+            break
+        last_url = urls[-1]
+
+        issue_ids, missing = issue_ids_for_urls(urls)
+
+        chunk_linked = Bid.objects.filter(issue=None, url__in=urls).update(
+            issue=Case(
+                *[When(url=url, then=Value(issue_id))
+                  for url, issue_id in issue_ids.items()],
+                output_field=IntegerField()
+            )
+        )
+        linked += chunk_linked
+        invalidation.invalidate(*[market_tag(url) for url in urls])
+        if stdout:
+            stdout.write("Linked %s bids on %s urls (%s new issues)" %
+                         (chunk_linked, len(urls), len(missing)))
+    return linked
+
+
+def save_bids(user, items):
+    """
+    Create or update user's bids from items of {url, ask, offer} in one
+    transaction, returning a (bid, created) pair per item. Later items
+    for a url override earlier ones.
+
+    The work the Bid receivers do on every save -- issue lookup, titles,
+    offer totals, ask matching and claim voters -- runs once per url.
+    """
+    changes = OrderedDict()
+    for item in items:
+        changes.setdefault(item['url'], {}).update(
+            (field, item[field]) for field in ('ask', 'offer')
+            if field in item)
+    urls = list(changes)
+    now = timezone.now()
+
+    with transaction.atomic():
+        existing = set(Bid.objects.select_for_update()
+                                  .filter(user=user, url__in=urls)
+                                  .values_list('url', flat=True))
+        new_urls = [url for url in urls if url not in existing]
+        if new_urls:
+            issue_ids, created_issues = issue_ids_for_urls(new_urls)
+            pages = dict((page.url, page) for page in
+                         PageTitle.objects.filter(url__in=new_urls))
+            for url in new_urls:
+                page = pages.get(url)
+                if (url not in created_issues and
+                        (page is None or not page.is_fresh())):
+                    TitleFetchJob.enqueue(url)
+            created = bulk_create_new(Bid, (
+                Bid(user=user, url=url, issue_id=issue_ids[url],
+                    title=getattr(pages.get(url), 'title', None) or None,
+                    created=now, **changes[url])
+                for url in new_urls
+            ))
+            # bids another request created meanwhile are updated instead
+            existing.update(set(new_urls) -
+                            set(bid.url for bid in created))
+        for url in existing:
+            if changes[url]:
+                # skip the per-bid receivers; their work runs once per
+                # url below
+                Bid.objects.filter(user=user, url=url).update(
+                    modified=now, **changes[url])
+
+        for url in urls:
+            OfferTotal.refresh(url)
+            notify_met_asks(url)
+            update_eligible_voters(url)
+
+    invalidation.invalidate('user:%s' % user.id,
+                            *[market_tag(url) for url in urls])
+    bids = dict((bid.url, bid) for bid in
+                Bid.objects.filter(user=user, url__in=urls))
+    return [(bids[item['url']], item['url'] not in existing)
+            for item in items]
+
+
+class IssueStateRefresher(object):
+    """
+    Looks up GitHub issue states on a bounded pool of threads.
+
+    Repository objects are memoized for the run, and lookups pause until
+    the X-RateLimit-Reset time when X-RateLimit-Remaining gets low. Each
+    issue is requested with its stored ETag, so unchanged issues cost a
+    304 that GitHub does not count against the rate limit.
+    """
+    def __init__(self, gh_client, workers=ISSUE_STATE_WORKERS, budget=None,
+                 reserve=RATE_LIMIT_RESERVE, sleep=time.sleep):
+        self.gh_client = gh_client
+        self.workers = workers
+        self.budget = budget
+        self.reserve = reserve
+        self.sleep = sleep
+        self._repos = {}
+        self._lock = threading.Lock()
+        # conditional request hits (304) and misses (200)
+        self.not_modified = 0
+        self.modified = 0
+        self.failed = 0
+
+    def get_repo(self, repo_name):
+        with self._lock:
+            if repo_name not in self._repos:
+                self._repos[repo_name] = self.gh_client.get_repo(repo_name)
+            return self._repos[repo_name]
+
+    def wait_for_rate_limit(self):
+        remaining, limit = self.gh_client.rate_limiting
+        if 0 <= remaining <= self.reserve:
+            reset = self.gh_client.rate_limiting_resettime
+            self.sleep(max(reset - time.time(), 0) + 1)
+
+    def lookup(self, issue):
+        """
+        Conditionally GET the issue with its stored ETag/Last-Modified.
+
+        Returns (issue, NOT_MODIFIED) on a 304, (issue, response) when
+        the issue changed, (issue, None) when the url isn't a GitHub
+        issue and (issue, LOOKUP_FAILED) when GitHub didn't answer with
+        the issue, so one bad issue doesn't end the run.
+        """
         try:
-            update(bid, issue=Issue.objects.get(url=bid.url))
-        except Issue.DoesNotExist:
-            state = issue_state(bid.url)
-            if state:
-                update(bid,
-                       issue=Issue.objects.create(url=bid.url, state=state))
+            return issue, self._get_issue(issue)
+        except Exception:
+            logger.exception("Looking up the state of %s failed", issue.url)
+            return issue, LOOKUP_FAILED
 
+    def _get_issue(self, issue):
+        match = GITHUB_ISSUE_RE.match(issue.url)
+        if not match:
+            return None
+        repo_name, number = match.groups()
+        self.wait_for_rate_limit()
+        repo = self.get_repo(repo_name)
 
-def update_issue_states(since=None):
+        headers = {}
+        if issue.etag:
+            headers['If-None-Match'] = issue.etag
+        if issue.last_modified:
+            headers['If-Modified-Since'] = issue.last_modified
+        try:
+            # PyGithub (pinned at 1.26) has no public conditional GET, so
+            # this borrows the repository's private requester
+            status, response_headers, output = repo._requester.requestJson(
+                'GET', '%s/issues/%s' % (repo.url, number), headers=headers)
+        except (AttributeError, TypeError):
+            # a PyGithub upgrade moved it; fetch without the validators
+            gh_issue = repo.get_issue(int(number))
+            return {
+                'state': gh_issue.state,
+                'etag': gh_issue.etag or '',
+                'last_modified': gh_issue.last_modified or '',
+            }
+
+        if status == 304:
+            return NOT_MODIFIED
+        if status != 200:
+            logger.warning("GitHub answered %s for %s", status, issue.url)
+            return LOOKUP_FAILED
+        return {
+            'state': json.loads(output)['state'],
+            'etag': response_headers.get('etag', ''),
+            'last_modified': response_headers.get('last-modified', ''),
+        }
+
+    def refresh(self, issues):
+        """
+        Save the current state of each issue; returns how many were
+        looked up.
+        """
+        if self.budget is not None:
+            issues = issues[:self.budget]
+        # evaluate in this thread so workers never touch the database
+        issues = list(issues)
+        if not issues:
+            return 0
+        pool = ThreadPool(min(self.workers, len(issues)))
+        try:
+            for issue, result in pool.imap_unordered(self.lookup, issues):
+                if result is LOOKUP_FAILED:
+                    self.failed += 1
+                elif result is NOT_MODIFIED:
+                    self.not_modified += 1
+                    update(issue, last_fetched=timezone.now())
+                elif result:
+                    self.modified += 1
+                    update(issue, last_fetched=timezone.now(), **result)
+        finally:
+            pool.close()
+            pool.join()
+        return len(issues)
+
+
+def sync_repo_issue_states(issues, refresher, stdout=None):
+    """
+    Sync issue states one repository at a time.
+
+    Each repository's issue listing is paged through once with
+    state=all&since=<oldest last_fetched>, and every issue in the repo is
+    saved with a single UPDATE, so API calls scale with repositories
+    instead of issues. Pages are paced with the refresher's rate-limit
+    wait. Returns the issues it could not sync this way, including those
+    of repositories whose listing failed.
+    """
+    by_repo = defaultdict(dict)
+    leftovers = []
+    for issue in issues:
+        match = GITHUB_ISSUE_RE.match(issue.url)
+        # an issue never fetched may not show up in a since= listing
+        if match and issue.state != 'unknown':
+            repo_name, number = match.groups()
+            by_repo[repo_name][int(number)] = issue
+        else:
+            leftovers.append(issue)
+
+    missing_repos = []
+    failed_repos = []
+    per_page = refresher.gh_client.per_page
+    for repo_name, repo_issues in by_repo.items():
+        since = min(tracked.last_fetched for tracked in repo_issues.values())
+        states = {}
+        # changes made while we page still show up in the next listing
+        synced_at = timezone.now()
+        try:
+            gh_issues = refresher.get_repo(repo_name).get_issues(
+                state='all', since=since)
+            page = 0
+            while True:
+                refresher.wait_for_rate_limit()
+                gh_page = gh_issues.get_page(page)
+                for gh_issue in gh_page:
+                    issue = repo_issues.get(gh_issue.number)
+                    if issue and gh_issue.state != issue.state:
+                        states[issue.id] = gh_issue.state
+                if len(gh_page) < per_page:
+                    break
+                page += 1
+        except UnknownObjectException:
+            logger.warning("GitHub repository %s not found", repo_name)
+            missing_repos.append(repo_name)
+            continue
+        except (GithubException, httplib.HTTPException, socket.error):
+            logger.exception("Listing the issues of %s failed", repo_name)
+            failed_repos.append(repo_name)
+            # look them up one at a time instead
+            leftovers.extend(repo_issues.values())
+            continue
+
+        new_state = Case(
+            *[When(id=issue_id, then=Value(state))
+              for issue_id, state in states.items()],
+            default=F('state'),
+            output_field=CharField()
+        )
+        Issue.objects.filter(
+            id__in=[tracked.id for tracked in repo_issues.values()]
+        ).update(state=new_state, last_fetched=synced_at)
+    if stdout:
+        stdout.write("Synced %s repositories (%s not found, %s failed)" %
+                     (len(by_repo) - len(missing_repos) - len(failed_repos),
+                      len(missing_repos), len(failed_repos)))
+    return leftovers
+
+
+def update_issue_states(since=None, workers=ISSUE_STATE_WORKERS,
+                        budget=None, by_repo=False, stdout=None):
     since = since or timezone.now() - timedelta(days=1)
-    gh_client = github_client()
-    for issue in Issue.objects.filter(last_fetched__lt=since):
-        state = issue_state(issue.url, gh_client)
-        if state:
-            update(issue, last_fetched=datetime.now(), state=state)
+    gh_client = github_api.client()
+    stale_issues = (Issue.objects.filter(last_fetched__lt=since)
+                                 .order_by('last_fetched'))
+    refresher = IssueStateRefresher(gh_client, workers=workers,
+                                    budget=budget)
+    if by_repo:
+        stale_issues = sync_repo_issue_states(stale_issues, refresher,
+                                              stdout=stdout)
+    refresher.refresh(stale_issues)
+    return refresher
+
+
+def title_session():
+    """
+    A requests session with pooled connections for the title fetcher.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=10, pool_maxsize=10)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def parse_title(html):
+    title_search = TITLE_RE.search(html)
+    if title_search:
+        title = HTMLParser.HTMLParser().unescape(title_search.group(1))
+        return title[:255]
+    return ''
+
+
+def refresh_page_title(url, session):
+    """
+    Fetch the title of url into its PageTitle, revalidating the cached
+    entry with If-None-Match/If-Modified-Since when there is one.
+    """
+    try:
+        page = PageTitle.objects.get(url=url)
+    except PageTitle.DoesNotExist:
+        page = PageTitle(url=url)
+
+    headers = {}
+    if page.etag:
+        headers['If-None-Match'] = page.etag
+    if page.last_modified:
+        headers['If-Modified-Since'] = page.last_modified
+
+    r = session.get(url, headers=headers, timeout=TITLE_FETCH_TIMEOUT)
+    if r.status_code != 304:
+        r.raise_for_status()
+        page.title = parse_title(r.text)
+        page.etag = r.headers.get('ETag', '')
+        page.last_modified = r.headers.get('Last-Modified', '')
+    page.fetched = timezone.now()
+    page.save()
+    return page
+
+
+def save_title_for_url(url, title):
+    # one UPDATE per table, skipping rows that already have the title
+    Bid.objects.filter(url=url).exclude(title=title).update(title=title)
+    Issue.objects.filter(url=url).exclude(title=title).update(title=title)
+    (Claim.objects.filter(evidence=url).exclude(title=title)
+                  .update(title=title))
+
+
+def fetch_titles(session=None, limit=None):
+    """
+    Drain due TitleFetchJobs, returning the number of titles saved.
+    """
+    session = session or title_session()
+    jobs = (TitleFetchJob.objects.filter(next_attempt__lte=timezone.now())
+                                 .order_by('next_attempt'))
+    if limit:
+        jobs = jobs[:limit]
+    saved = 0
+    for job in jobs:
+        try:
+            page = refresh_page_title(job.url, session)
+        except requests.RequestException as e:
+            job.retry(e)
+            continue
+        if page.title:
+            save_title_for_url(job.url, page.title)
+            saved += 1
+        job.delete()
+    return saved
+
+
+def process_offer_payments(limit=None):
+    """
+    Charge queued offers, oldest first, returning the number charged.
+    """
+    jobs = (OfferPaymentJob.objects.select_related('offer__bid',
+                                                   'offer__user')
+                                   .order_by('created'))
+    if limit:
+        jobs = jobs[:limit]
+    charged = 0
+    for job in jobs:
+        if job.run():
+            charged += 1
+    return charged
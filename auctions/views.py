@@ -1,12 +1,16 @@
 from decimal import Decimal
 
+from django.conf import settings
 from django.shortcuts import redirect, get_object_or_404
 from django.core.urlresolvers import reverse
 from django.contrib import messages
+from django.http import HttpResponse, JsonResponse
+from django.middleware.csrf import get_token
 
-from auctions.models import Bid, Claim, Vote
+from auctions import widget_cache
+from auctions.models import Bid, Claim, Offer, OfferPaymentJob, Vote
 
-from django.views.generic import TemplateView
+from django.views.generic import TemplateView, View
 from django.contrib.auth.mixins import LoginRequiredMixin
 
 
@@ -19,19 +23,60 @@ class BidStatusView(LoginRequiredMixin, TemplateView):
     """
     template_name = "addon/widget.html"
 
-    def _get_bid(self, url):
+    def _get_bid(self, url, for_widget=False):
         bid = None
+        bids = Bid.objects
+        if for_widget:
+            # everything widget_state reads, in two queries
+            bids = (bids.with_offer_totals()
+                        .select_related('issue')
+                        .prefetch_related('issue__claim_set'))
         try:
-            bid = Bid.objects.get(user=self.request.user, url=url)
+            bid = bids.get(user=self.request.user, url=url)
         except:
             # pass to return (None, None) to caller
             pass
         return bid
 
+    def get(self, request, *args, **kwargs):
+        """
+        Serve the widget from widget_cache while the url's market hasn't
+        changed, when settings.WIDGET_CACHE is on. Widgets showing
+        messages or an offer's progress aren't cached.
+        """
+        if (not settings.WIDGET_CACHE or 'offer' in request.GET or
+                messages.get_messages(request)):
+            return super(BidStatusView, self).get(request, *args, **kwargs)
+        url = request.GET['url']
+        # the forms carry the csrf token, so it's part of the key
+        csrf_token = get_token(request)
+        html, versions = widget_cache.lookup(request.user.id, url,
+                                             csrf_token)
+        if html is not None:
+            return HttpResponse(html)
+        response = super(BidStatusView, self).get(request, *args, **kwargs)
+        response.render()
+        widget_cache.store(request.user.id, url, csrf_token, versions,
+                           response.content)
+        return response
+
     def get_context_data(self, **kwargs):
         url = self.request.GET['url']
-        bid = self._get_bid(url)
-        return dict({'bid': bid, 'url': url})
+        bid = self._get_bid(url, for_widget=True)
+        widget = bid.widget_state(self.request.user) if bid else None
+        context = dict({'bid': bid, 'url': url, 'widget': widget})
+        offer_id = self.request.GET.get('offer', '')
+        offer = None
+        if offer_id.isdigit():
+            offer = Offer.objects.filter(pk=offer_id,
+                                         user=self.request.user).first()
+        if offer:
+            # a finished offer's message stays on the reloaded widget
+            context['offer_status'] = OfferStatusView.status(offer)
+            if context['offer_status']['status'] == 'pending':
+                context['offer_status_url'] = reverse(
+                    'offer-status', kwargs={'pk': offer.id})
+        return context
 
     def post(self, *args, **kwargs):
         """
@@ -60,19 +105,51 @@ class BidStatusView(LoginRequiredMixin, TemplateView):
 
         if new_offer_amount:
             new_offer_amount = Decimal(self.request.POST['offer'])
-            # TODO: move most/all of this logic into Bid.make_offer()
             if new_offer_amount > bid.offer:
+                if OfferPaymentJob.objects.filter(offer__bid=bid).exists():
+                    messages.error(self.request,
+                                   "Your last offer is still processing")
+                    return redirect_response
                 new_offer = bid.make_offer(new_offer_amount)
-                if new_offer.request():
-                    messages.success(self.request, "Thanks for the offer!")
-                    bid.offer = new_offer_amount
-                    bid.save()
-                else:
-                    messages.error(self.request, new_offer.error_message)
+                if new_offer:
+                    # charged by process_offer_payments; the widget polls
+                    # offer-status until it's done
+                    OfferPaymentJob.objects.create(
+                        offer=new_offer, bid_offer=new_offer_amount)
+                    return redirect(
+                        "%s?url=%s&offer=%s" % (reverse('bid-status'), url,
+                                                new_offer.id)
+                    )
 
         return redirect_response
 
 
+class OfferStatusView(LoginRequiredMixin, View):
+    """
+    Requests for /offer-status/{id} receive the JSON status of the user's
+    offer payment, for the widget to poll while the charge is processed.
+
+    id -- id of offer
+    """
+    MESSAGES = {
+        'pending': "Processing your offer",
+        'succeeded': "Thanks for the offer!",
+    }
+
+    @classmethod
+    def status(cls, offer):
+        status = offer.payment_status()
+        return {
+            'status': status,
+            'message': cls.MESSAGES.get(status, offer.error_message),
+        }
+
+    def get(self, request, *args, **kwargs):
+        offer = get_object_or_404(Offer, pk=self.kwargs['pk'],
+                                  user=request.user)
+        return JsonResponse(self.status(offer))
+
+
 class ClaimStatusView(LoginRequiredMixin, TemplateView):
     """
     Requests for /claim-status/{id} will receive the claim details, along with
@@ -87,7 +164,8 @@ class ClaimStatusView(LoginRequiredMixin, TemplateView):
         claim = None
         vote = None
         try:
-            claim = Claim.objects.get(pk=self.kwargs['pk'])
+            claim = (Claim.objects.select_related('user', 'issue')
+                                  .get(pk=self.kwargs['pk']))
             vote = Vote.objects.get(claim=claim, user=self.request.user)
         except:
             pass
@@ -106,7 +184,7 @@ class ClaimStatusView(LoginRequiredMixin, TemplateView):
         try:
             if request.user == claim.user:
                 if claim.payout_request():
-                    messages.success(request, 'Your payout was sent')
+                    messages.success(request, 'Your payout is on its way')
                 else:
                     messages.error(request, "Sorry please try later")
             else:
@@ -129,7 +207,11 @@ class BidList(LoginRequiredMixin, TemplateView):
 
     def get_context_data(self, **kwargs):
         try:
-            bids = (Bid.objects.filter(user=self.request.user)
+            bids = (Bid.objects.with_offer_totals()
+                    .filter(user=self.request.user)
+                    .select_related('issue')
+                    .prefetch_related('payments__offer_fees',
+                                      'issue__claim_set')
                     .order_by('-created'))
         except:
             bids = []
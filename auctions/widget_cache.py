@@ -0,0 +1,34 @@
+"""
+Fragment cache for the addon widget.
+
+A widget is cached per (user, url, csrf token) under the url's market
+tag, so any save that changes the market for the url invalidates it; see
+codesy.invalidation.
+"""
+from hashlib import sha1
+
+from codesy import invalidation
+
+from .models import market_tag
+
+
+FRAGMENT_TIMEOUT = 600
+
+
+def fragment_key(user_id, url, csrf_token):
+    return 'widget:%s:%s:%s' % (user_id, sha1(url.encode('utf-8')).hexdigest(),
+                                csrf_token)
+
+
+def lookup(user_id, url, csrf_token):
+    """
+    Returns (html, versions): the cached widget, or None when it's missing
+    or out of date, and the tag versions to store a fresh render under.
+    """
+    return invalidation.lookup(fragment_key(user_id, url, csrf_token),
+                               [market_tag(url)])
+
+
+def store(user_id, url, csrf_token, versions, html):
+    invalidation.store(fragment_key(user_id, url, csrf_token), versions,
+                       html, FRAGMENT_TIMEOUT)
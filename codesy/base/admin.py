@@ -14,7 +14,7 @@ class CodesyUserAdmin(UserAdmin):
     form = CodesyUserChangeForm
 
     fieldsets = UserAdmin.fieldsets + (
-        ('Payments', {'fields': ('stripe_account_token',)}),
+        ('Payments', {'fields': ('stripe_account_token', 'stripe_error')}),
     )
 
 admin.site.register(User, CodesyUserAdmin)
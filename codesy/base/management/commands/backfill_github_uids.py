@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Case, CharField, Value, When
+
+from allauth.socialaccount.models import SocialAccount
+
+from codesy.base.models import User
+
+
+class Command(BaseCommand):
+    help = "Copy GitHub uids from social accounts onto their users."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help="Users to update per query.")
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        uids = list(SocialAccount.objects.filter(provider='github',
+                                                 user__github_uid='')
+                                         .values_list('user_id', 'uid'))
+        updated = 0
+        for start in range(0, len(uids), chunk_size):
+            chunk = uids[start:start + chunk_size]
+            updated += User.objects.filter(
+                id__in=[user_id for user_id, uid in chunk]
+            ).update(github_uid=Case(
+                *[When(id=user_id, then=Value(uid)) for user_id, uid in chunk],
+                output_field=CharField()
+            ))
+        self.stdout.write("Saved GitHub uids for %s users" % updated)
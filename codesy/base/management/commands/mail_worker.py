@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from codesy.mail import MailWorker
+
+
+class Command(BaseCommand):
+    help = ("Send the django-mailer queue over one persistent SMTP "
+            "connection until interrupted.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help="Messages to send per batch.")
+        parser.add_argument('--idle-sleep', type=float, default=5,
+                            help="Seconds to wait when the queue is empty.")
+        parser.add_argument('--retry-after', type=int, default=60,
+                            help="Initial seconds before retrying deferred "
+                                 "messages.")
+        parser.add_argument('--report-every', type=int, default=60,
+                            help="Seconds between metrics reports.")
+
+    def handle(self, *args, **options):
+        worker = MailWorker(batch_size=options['batch_size'],
+                            idle_sleep=options['idle_sleep'],
+                            retry_after=options['retry_after'],
+                            report_every=options['report_every'],
+                            report=self.stdout.write)
+        try:
+            worker.run()
+        except KeyboardInterrupt:
+            pass
+        worker.report_metrics()
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from codesy.base.models import User
+
+
+class Command(BaseCommand):
+    help = "Create Stripe customers for card tokens saved by users."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', type=float, default=None,
+                            metavar='SECONDS',
+                            help="Keep running, sleeping SECONDS between "
+                                 "passes.")
+
+    def handle(self, *args, **options):
+        while True:
+            provisioned = failed = 0
+            for user in User.objects.exclude(stripe_cc_token=''):
+                if user.provision_stripe_customer():
+                    provisioned += 1
+                else:
+                    failed += 1
+            self.stdout.write("Provisioned %s customers, %s failed" %
+                              (provisioned, failed))
+            if not options['loop']:
+                break
+            time.sleep(options['loop'])
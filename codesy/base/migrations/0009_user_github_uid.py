@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2026-10-17 18:43
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0008_user_stripe_error'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='github_uid',
+            field=models.CharField(blank=True, max_length=191),
+        ),
+    ]
@@ -1,54 +1,107 @@
-import requests
+from hashlib import sha1
+
 import stripe
 
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser
 from django.db import models
-from django.db.models.signals import pre_save
+from django.db.models.signals import post_save, pre_save
 from django.dispatch import receiver
 
 from allauth.account.signals import user_signed_up
+from allauth.socialaccount.models import SocialAccount
+
+from codesy import github_api
 
 
-EMAIL_URL = 'https://api.github.com/user/emails'
 stripe.api_key = settings.STRIPE_SECRET_KEY
+AVATAR_URL = "https://avatars3.githubusercontent.com/u/%s?v=3&s=96"
 
 
 class User(AbstractUser):
     # TODO: remove this as we don't need or want to store it
     stripe_cc_token = models.CharField(max_length=100, blank=True)
     stripe_account_token = models.CharField(max_length=100, blank=True)
+    stripe_error = models.CharField(max_length=255, blank=True)
+    # copied from the GitHub SocialAccount so avatars cost no query
+    github_uid = models.CharField(max_length=191, blank=True)
     USERNAME_FIELD = 'username'
 
+    @property
+    def stripe_pending(self):
+        """
+        A card token is waiting for provision_stripe_customers to turn it
+        into a Stripe customer.
+        """
+        return bool(self.stripe_cc_token)
+
+    def provision_stripe_customer(self):
+        """
+        Create a Stripe customer from the pending card token. The
+        idempotency key comes from the token, so a retry after a lost
+        response gets the same customer back instead of a second one.
+        Returns whether the user now has a customer.
+        """
+        cc_token = self.stripe_cc_token
+        if not cc_token:
+            return False
+        try:
+            new_customer = stripe.Customer.create(
+                source=cc_token,
+                description=self.email,
+                idempotency_key='customer-%s' % sha1(cc_token).hexdigest(),
+            )
+            if new_customer:
+                self.stripe_account_token = new_customer.id
+                self.stripe_error = ""
+            else:
+                self.stripe_error = "Card setup failed, try later"
+        except Exception as e:
+            self.stripe_error = e.message
+        # card tokens are single-use, so clear it either way; unless the
+        # user sent a newer one meanwhile
+        self.stripe_cc_token = ""
+        User.objects.filter(pk=self.pk, stripe_cc_token=cc_token).update(
+            stripe_cc_token=self.stripe_cc_token,
+            stripe_account_token=self.stripe_account_token,
+            stripe_error=self.stripe_error,
+        )
+        return not self.stripe_error
+
     def get_gravatar_url(self):
-        github_account = self.socialaccount_set.get(provider='github')
-        return ("https://avatars3.githubusercontent.com/u/%s?v=3&s=96" %
-                github_account.uid)
+        uid = self.github_uid
+        if not uid:
+            # .all() so a prefetched socialaccount_set is used
+            for account in self.socialaccount_set.all():
+                if account.provider == 'github':
+                    uid = account.uid
+                    break
+            else:
+                return ''
+        return AVATAR_URL % uid
 
 
 @receiver(pre_save, sender=settings.AUTH_USER_MODEL)
-def replace_cc_token_with_account_token(sender, instance, **kwargs):
+def clear_stripe_error_for_new_cc_token(sender, instance, **kwargs):
+    # the customer itself is created by provision_stripe_customers
     if instance.stripe_cc_token:
-        new_customer = stripe.Customer.create(
-            source=instance.stripe_cc_token,
-            description=instance.email
-        )
-        if new_customer:
-            instance.stripe_cc_token = ""
-            instance.stripe_account_token = new_customer.id
+        instance.stripe_error = ""
+
+
+@receiver(post_save, sender=SocialAccount)
+def save_github_uid(sender, instance, **kwargs):
+    # allauth saves the account on signup, connect and every login
+    if instance.provider == 'github':
+        # one UPDATE, which matches no row once the uid is stored
+        (User.objects.filter(pk=instance.user_id)
+                     .exclude(github_uid=instance.uid)
+                     .update(github_uid=instance.uid))
 
 
 @receiver(user_signed_up)
 def add_email_from_signup_and_start_inactive(sender, request, user, **kwargs):
     user.is_active = False
-    params = {'access_token': kwargs['sociallogin'].token}
-    email_data = requests.get(EMAIL_URL, params=params).json()
-    if email_data:
-        verified_emails = [e for e in email_data if e['verified']]
-        if not verified_emails:
-            return None
-        sorted_emails = sorted(verified_emails,
-                               key=lambda e: (e['primary'], e['verified']),
-                               reverse=True)
-        user.email = sorted_emails[0]['email']
+    emails = github_api.verified_emails(str(kwargs['sociallogin'].token))
+    if emails:
+        user.email = emails[0]
         user.save()
@@ -0,0 +1,47 @@
+"""
+Cache configuration.
+
+CACHE_URL picks the backend, the same way DATABASE_URL picks the
+database:
+
+    locmem://[name]                       per-process memory (tests)
+    file:///path/to/dir                   files shared by local processes
+    redis://[:password@]host[:port][/db]  Redis, through django-redis
+    dummy://                              no caching
+"""
+import urlparse
+
+
+BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'redis': 'django_redis.cache.RedisCache',
+    'dummy': 'django.core.cache.backends.dummy.DummyCache',
+}
+# seconds
+REDIS_SOCKET_TIMEOUT = 1
+
+
+def parse_cache_url(url):
+    """
+    Return the CACHES entry for a CACHE_URL.
+    """
+    parsed = urlparse.urlparse(url)
+    if parsed.scheme not in BACKENDS:
+        raise ValueError("Unknown cache backend: %s" % url)
+    config = {'BACKEND': BACKENDS[parsed.scheme]}
+    if parsed.scheme == 'locmem':
+        config['LOCATION'] = parsed.netloc
+    elif parsed.scheme == 'file':
+        config['LOCATION'] = parsed.path
+    elif parsed.scheme == 'redis':
+        config['LOCATION'] = 'redis://%s%s:%s/%s' % (
+            ':%s@' % parsed.password if parsed.password else '',
+            parsed.hostname or 'localhost',
+            parsed.port or 6379,
+            int(parsed.path.strip('/') or 0))
+        config['OPTIONS'] = {
+            'SOCKET_CONNECT_TIMEOUT': REDIS_SOCKET_TIMEOUT,
+            'SOCKET_TIMEOUT': REDIS_SOCKET_TIMEOUT,
+        }
+    return config
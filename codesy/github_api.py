@@ -0,0 +1,89 @@
+"""
+Shared GitHub HTTP client.
+
+GitHub API calls go through one pooled requests session with strict
+timeouts and a small retry budget, so a slow GitHub can't hold up the
+request that needs it, e.g. the signup flow.
+"""
+import threading
+from hashlib import sha1
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+from django.core.cache import cache
+
+from decouple import config
+from github import Github
+
+
+API_URL = 'https://api.github.com'
+EMAIL_URL = API_URL + '/user/emails'
+# (connect, read) seconds
+TIMEOUT = (3.05, 5)
+POOL_SIZE = 10
+# retry refused connections and GitHub 5xx answers, reads only once
+RETRIES = Retry(total=2, connect=2, read=1, backoff_factor=0.1,
+                status_forcelist=(500, 502, 503, 504),
+                method_whitelist=frozenset(['GET', 'HEAD']))
+# long enough to cover one login flow
+EMAIL_CACHE_SECONDS = 300
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def session():
+    """
+    The project's pooled session for api.github.com.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_SIZE,
+                                  pool_maxsize=POOL_SIZE,
+                                  max_retries=RETRIES)
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+    return _session
+
+
+def get(url, **kwargs):
+    kwargs.setdefault('timeout', TIMEOUT)
+    return session().get(url, **kwargs)
+
+
+def client():
+    """
+    A PyGithub client authenticated as the codesy app. PyGithub makes its
+    own connections, but gets the same read timeout.
+    """
+    return Github(client_id=config('GITHUB_CLIENT_ID'),
+                  client_secret=config('GITHUB_CLIENT_SECRET'),
+                  timeout=TIMEOUT[1])
+
+
+def verified_emails(access_token):
+    """
+    The verified email addresses of the token's user, primary first.
+
+    Lists are cached per token for EMAIL_CACHE_SECONDS. When GitHub can't
+    be reached the result is an empty list, which is not cached.
+    """
+    key = 'github-emails-%s' % sha1(access_token).hexdigest()
+    emails = cache.get(key)
+    if emails is None:
+        try:
+            r = get(EMAIL_URL, params={'access_token': access_token})
+            r.raise_for_status()
+            email_data = r.json()
+        except (requests.RequestException, ValueError):
+            return []
+        verified = [e for e in email_data if e['verified']]
+        emails = [e['email'] for e in sorted(verified,
+                                             key=lambda e: e['primary'],
+                                             reverse=True)]
+        cache.set(key, emails, EMAIL_CACHE_SECONDS)
+    return emails
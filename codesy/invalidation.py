@@ -0,0 +1,87 @@
+"""
+Tag-based cache invalidation.
+
+A cached value names the tags it depends on, e.g. 'url:<issue url>' or
+'user:<id>'. Each tag has a version in the cache and the value is stored
+with the versions it was computed under; invalidating a tag bumps its
+version, which orphans every value stored under the old one. Models turn
+their saves into invalidations with cache_tags(), see auctions.models.
+
+Versions start from a random 62-bit number, so a tag whose version was
+evicted doesn't come back with a version an old value was stored under.
+
+Invalidations wait for the surrounding transaction to commit; bumped any
+earlier, a concurrent read could cache the old rows under the new version.
+"""
+import random
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+def tag_key(tag):
+    return 'tag:%s' % tag
+
+
+def _new_version():
+    return random.getrandbits(62)
+
+
+def _bump(tags):
+    for tag in tags:
+        key = tag_key(tag)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _new_version(), None)
+
+
+def invalidate(*tags):
+    """
+    Bump the versions of tags once the current transaction commits, or
+    right away outside of one.
+    """
+    tags = set(tags)
+    transaction.on_commit(lambda: _bump(tags))
+
+
+def lookup(key, tags):
+    """
+    Returns (value, versions): the value cached under key, or None when
+    it's missing or one of its tags was invalidated since, and the
+    versions to set a fresh value under. The tag versions and the value
+    come back in one get_many.
+    """
+    tag_keys = [tag_key(tag) for tag in tags]
+    found = cache.get_many(tag_keys + [key])
+    versions = []
+    for t_key in tag_keys:
+        version = found.get(t_key)
+        if version is None:
+            version = _new_version()
+            if not cache.add(t_key, version, None):
+                # invalidated meanwhile
+                version = cache.get(t_key)
+        versions.append(version)
+    versions = tuple(versions)
+    entry = found.get(key)
+    if entry is not None and entry[0] == versions:
+        return entry[1], versions
+    return None, versions
+
+
+def store(key, versions, value, timeout=None):
+    cache.set(key, (versions, value), timeout)
+
+
+def cached(key, tags, compute, timeout=None):
+    """
+    The value cached under key for tags, calling compute() to fill it on
+    a miss. Values of None aren't cached.
+    """
+    value, versions = lookup(key, tags)
+    if value is None:
+        value = compute()
+        if value is not None:
+            store(key, versions, value, timeout)
+    return value
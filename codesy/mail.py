@@ -0,0 +1,211 @@
+import smtplib
+import time
+from socket import error as socket_error
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models.functions import Lower
+from django.utils.encoding import force_text
+
+from mailer import get_priority
+from mailer.models import (PRIORITY_MEDIUM, RESULT_FAILURE, RESULT_SUCCESS,
+                           DontSendEntry, Message, MessageLog)
+
+SEND_ERRORS = (socket_error, smtplib.SMTPException)
+
+
+def send_mass_mail(datatuple, priority=None):
+    """
+    Queue (subject, message, from_email, recipient_list) tuples for
+    django-mailer with one don't-send lookup and one INSERT, instead of
+    the query and INSERT per message that mailer.send_mail costs.
+    """
+    datatuple = list(datatuple)
+    if not datatuple:
+        return 0
+    priority = get_priority(priority)
+
+    addresses = set(address.lower()
+                    for subject, message, from_email, recipient_list
+                    in datatuple for address in recipient_list)
+    dont_send = set(DontSendEntry.objects
+                    .annotate(address=Lower('to_address'))
+                    .filter(address__in=addresses)
+                    .values_list('address', flat=True))
+
+    messages = []
+    for subject, message, from_email, recipient_list in datatuple:
+        to = [address for address in recipient_list
+              if address.lower() not in dont_send]
+        if not to:
+            continue
+        db_msg = Message(priority=priority)
+        db_msg.email = EmailMessage(subject=force_text(subject),
+                                    body=force_text(message),
+                                    from_email=from_email,
+                                    to=to)
+        messages.append(db_msg)
+    Message.objects.bulk_create(messages)
+    return len(messages)
+
+
+class MailWorker(object):
+    """
+    Long-running sender for the django-mailer queue.
+
+    Keeps one SMTP connection open across batches and reconnects when it
+    fails, sends queued messages most urgent first, and puts deferred
+    messages back in the queue with exponential backoff. Each batch is
+    claimed with SELECT ... FOR UPDATE, so a second worker waits for it
+    instead of sending the same messages again.
+    """
+    def __init__(self, batch_size=100, idle_sleep=5, retry_after=60,
+                 max_retry_after=3600, report_every=60, report=None,
+                 sleep=time.sleep, clock=time.time, **connection_kwargs):
+        self.backend = getattr(settings, 'MAILER_EMAIL_BACKEND',
+                               'django.core.mail.backends.smtp.EmailBackend')
+        self.connection_kwargs = connection_kwargs
+        self.connection = None
+        self.batch_size = batch_size
+        self.idle_sleep = idle_sleep
+        self.retry_after = retry_after
+        self.max_retry_after = max_retry_after
+        self.report_every = report_every
+        self.report = report
+        self.sleep = sleep
+        self.clock = clock
+
+        self.sent = 0
+        self.deferred = 0
+        self.started = clock()
+        self.next_report = self.started + report_every
+        self.retry_delay = retry_after
+        self.next_retry = self.started + retry_after
+        self.deferred_at_retry = None
+
+    def connect(self):
+        if self.connection is None:
+            connection = get_connection(backend=self.backend,
+                                        **self.connection_kwargs)
+            connection.open()
+            self.connection = connection
+        return self.connection
+
+    def disconnect(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except SEND_ERRORS:
+                pass
+            self.connection = None
+
+    def _send(self, email):
+        email.connection = self.connect()
+        try:
+            email.send()
+        except smtplib.SMTPServerDisconnected:
+            # the server dropped an idle connection; reconnect once
+            self.disconnect()
+            email.connection = self.connect()
+            email.send()
+
+    def send_batch(self):
+        """
+        Send up to batch_size queued messages. Returns how many were tried.
+        """
+        try:
+            self.connect()
+        except SEND_ERRORS:
+            # leave the queue alone until the server is back
+            self.disconnect()
+            return 0
+
+        queue = Message.objects.non_deferred().order_by('priority',
+                                                        'when_added')
+        with transaction.atomic():
+            messages = list(queue.select_for_update()[:self.batch_size])
+            done = []
+            logs = []
+            for message in messages:
+                email = message.email
+                if email is None:
+                    # undecodable, discarded as mailer.engine does
+                    done.append(message.id)
+                    continue
+                try:
+                    self._send(email)
+                except SEND_ERRORS as err:
+                    message.defer()
+                    logs.append(self._log(message, RESULT_FAILURE, str(err)))
+                    self.deferred += 1
+                    self.disconnect()
+                else:
+                    done.append(message.id)
+                    logs.append(self._log(message, RESULT_SUCCESS))
+                    self.sent += 1
+            Message.objects.filter(id__in=done).delete()
+            MessageLog.objects.bulk_create(logs)
+        return len(messages)
+
+    def _log(self, message, result, log_message=''):
+        return MessageLog(message_data=message.message_data,
+                          when_added=message.when_added,
+                          priority=message.priority,
+                          result=result,
+                          log_message=log_message)
+
+    def retry_deferred(self):
+        """
+        Requeue deferred messages once their backoff has passed. The wait
+        doubles while retried messages keep failing.
+        """
+        now = self.clock()
+        if now < self.next_retry:
+            return 0
+        retried = self.deferred_at_retry is not None
+        if retried and self.deferred > self.deferred_at_retry:
+            self.retry_delay = min(self.retry_delay * 2,
+                                   self.max_retry_after)
+        else:
+            self.retry_delay = self.retry_after
+        self.deferred_at_retry = self.deferred
+        self.next_retry = now + self.retry_delay
+        return Message.objects.deferred().update(priority=PRIORITY_MEDIUM)
+
+    def metrics(self):
+        elapsed = max(self.clock() - self.started, 1)
+        return {
+            'sent': self.sent,
+            'deferred': self.deferred,
+            'per_minute': self.sent * 60.0 / elapsed,
+            'queued': Message.objects.non_deferred().count(),
+            'queued_deferred': Message.objects.deferred().count(),
+        }
+
+    def report_metrics(self):
+        metrics = self.metrics()
+        if self.report:
+            self.report(
+                "%(sent)s sent (%(per_minute).1f/min), %(deferred)s "
+                "deferred; queue: %(queued)s waiting, %(queued_deferred)s "
+                "deferred" % metrics)
+        return metrics
+
+    def run(self, batches=None):
+        """
+        Send until interrupted, or for the given number of batches.
+        """
+        try:
+            while batches is None or batches > 0:
+                self.retry_deferred()
+                tried = self.send_batch()
+                if self.clock() >= self.next_report:
+                    self.report_metrics()
+                    self.next_report = self.clock() + self.report_every
+                if batches is not None:
+                    batches -= 1
+                if tried < self.batch_size:
+                    self.sleep(self.idle_sleep)
+        finally:
+            self.disconnect()
@@ -12,6 +12,8 @@ import os
 import dj_database_url
 from decouple import config
 
+from codesy.cache import parse_cache_url
+
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(__file__))
@@ -116,6 +118,29 @@ DATABASES = {'default': config(
     default="postgres://postgres@localhost:5432/codesy",
     cast=dj_database_url.parse)}
 
+# locmem://, file:///path or redis://host:port/db; see codesy.cache
+CACHE_URL = config('CACHE_URL', default='locmem://')
+CACHES = {'default': parse_cache_url(CACHE_URL)}
+
+# the widget cache is invalidated by the worker dynos too, so it needs a
+# cache every process shares
+WIDGET_CACHE = config('WIDGET_CACHE',
+                      default=CACHE_URL.startswith('redis://'),
+                      cast=bool)
+
+
+# the worker dynos log to stderr, which Heroku collects
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'auctions': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/1.6/topics/i18n/
@@ -163,7 +188,6 @@ REST_FRAMEWORK = {
     ),
     'DEFAULT_PERMISSION_CLASSES':
         ('rest_framework.permissions.IsAuthenticated',),
-    'PAGINATE_BY': 10
 }
 
 SWAGGER_SETTINGS = {
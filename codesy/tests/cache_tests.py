@@ -0,0 +1,130 @@
+import time
+
+from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase
+from django_redis.cache import RedisCache
+
+from .. import invalidation
+from ..cache import parse_cache_url
+from .fake_redis import FakeRedisServer
+
+
+class ParseCacheUrlTest(TestCase):
+    def test_locmem(self):
+        self.assertEqual(
+            {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+             'LOCATION': ''},
+            parse_cache_url('locmem://'))
+
+    def test_file(self):
+        self.assertEqual(
+            {'BACKEND':
+             'django.core.cache.backends.filebased.FileBasedCache',
+             'LOCATION': '/var/tmp/codesy'},
+            parse_cache_url('file:///var/tmp/codesy'))
+
+    def test_redis(self):
+        config = parse_cache_url('redis://:secret@cache.local:6380/2')
+        self.assertEqual('django_redis.cache.RedisCache', config['BACKEND'])
+        self.assertEqual('redis://:secret@cache.local:6380/2',
+                         config['LOCATION'])
+        self.assertEqual('redis://localhost:6379/0',
+                         parse_cache_url('redis://')['LOCATION'])
+
+    def test_unknown_backend(self):
+        self.assertRaises(ValueError, parse_cache_url, 'memcache://')
+
+
+class RedisCacheTest(TestCase):
+    def setUp(self):
+        self.server = FakeRedisServer(password='secret').__enter__()
+        config = parse_cache_url(
+            'redis://:secret@%s/1' % self.server.location)
+        self.cache = RedisCache(config['LOCATION'], config)
+
+    def tearDown(self):
+        self.server.__exit__()
+
+    def test_get_set_delete(self):
+        self.assertEqual('default', self.cache.get('missing', 'default'))
+        self.cache.set('key', {'a': [1, 2]})
+        self.assertEqual({'a': [1, 2]}, self.cache.get('key'))
+        self.assertTrue('key' in self.cache)
+        # in the configured database
+        self.assertEqual([':1:key'], self.server.dbs[1].keys())
+        self.cache.delete('key')
+        self.assertEqual(None, self.cache.get('key'))
+
+    def test_add(self):
+        self.assertTrue(self.cache.add('key', 'first'))
+        self.assertFalse(self.cache.add('key', 'second'))
+        self.assertEqual('first', self.cache.get('key'))
+
+    def test_timeout(self):
+        self.cache.set('key', 'value', 0.05)
+        self.assertEqual('value', self.cache.get('key'))
+        time.sleep(0.1)
+        self.assertEqual(None, self.cache.get('key'))
+
+    def test_get_many_in_one_command(self):
+        self.cache.set_many({'a': 1, 'b': 'two'})
+        self.server.commands = []
+        self.assertEqual({'a': 1, 'b': 'two'},
+                         self.cache.get_many(['a', 'b', 'c']))
+        self.assertEqual(1, len(self.server.commands))
+
+    def test_incr_is_one_command(self):
+        self.assertRaises(ValueError, self.cache.incr, 'counter')
+        self.cache.set('counter', 41)
+        self.server.commands = []
+        self.assertEqual(42, self.cache.incr('counter'))
+        # no gap between the existence check and the increment for an
+        # eviction to fall into
+        self.assertEqual(['EVAL'], [c[0] for c in self.server.commands])
+        self.assertEqual(42, self.cache.get('counter'))
+
+    def test_clear(self):
+        self.cache.set('key', 'value')
+        self.cache.clear()
+        self.assertEqual(None, self.cache.get('key'))
+
+    def test_reconnects_after_dropped_connection(self):
+        self.cache.set('key', 'value')
+        self.server.drop_connections()
+        self.assertEqual('value', self.cache.get('key'))
+        self.assertEqual(2, self.server.connections)
+
+
+class InvalidationTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_store_and_lookup(self):
+        value, versions = invalidation.lookup('key', ['a', 'b'])
+        self.assertEqual(None, value)
+        invalidation.store('key', versions, 'value')
+        self.assertEqual('value', invalidation.lookup('key', ['a', 'b'])[0])
+
+    def test_invalidate_orphans_values(self):
+        value, versions = invalidation.lookup('key', ['a', 'b'])
+        invalidation.store('key', versions, 'value')
+        invalidation.invalidate('b')
+        self.assertEqual(None, invalidation.lookup('key', ['a', 'b'])[0])
+
+    def test_evicted_tag_orphans_values(self):
+        value, versions = invalidation.lookup('key', ['a'])
+        invalidation.store('key', versions, 'value')
+        cache.delete(invalidation.tag_key('a'))
+        self.assertEqual(None, invalidation.lookup('key', ['a'])[0])
+
+    def test_cached(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return len(calls)
+
+        self.assertEqual(1, invalidation.cached('key', ['a'], compute))
+        self.assertEqual(1, invalidation.cached('key', ['a'], compute))
+        invalidation.invalidate('a')
+        self.assertEqual(2, invalidation.cached('key', ['a'], compute))
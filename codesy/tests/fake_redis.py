@@ -0,0 +1,196 @@
+import SocketServer
+import fnmatch
+import threading
+import time
+
+
+class FakeRedisHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        server = self.server
+        server.connections += 1
+        server.sockets.append(self.connection)
+        self.db = 0
+        while True:
+            try:
+                command = self.read_command()
+            except Exception:
+                return
+            if command is None:
+                return
+            server.commands.append(command)
+            name = command[0].upper()
+            handler = getattr(self, 'cmd_' + name.lower(), None)
+            if handler is None:
+                self.error("ERR unknown command '%s'" % name)
+            else:
+                handler(*command[1:])
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        count = int(line[1:])
+        args = []
+        for i in range(count):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    @property
+    def data(self):
+        return self.server.dbs.setdefault(self.db, {})
+
+    def _get(self, key):
+        item = self.data.get(key)
+        if item is None:
+            return None
+        value, expires = item
+        if expires is not None and expires <= time.time():
+            del self.data[key]
+            return None
+        return value
+
+    def write(self, reply):
+        self.wfile.write(reply)
+
+    def ok(self):
+        self.write('+OK\r\n')
+
+    def error(self, message):
+        self.write('-%s\r\n' % message)
+
+    def integer(self, value):
+        self.write(':%d\r\n' % value)
+
+    def bulk(self, value):
+        if value is None:
+            self.write('$-1\r\n')
+        else:
+            self.write('$%d\r\n%s\r\n' % (len(value), value))
+
+    def cmd_ping(self):
+        self.write('+PONG\r\n')
+
+    def cmd_auth(self, password):
+        if password == self.server.password:
+            self.ok()
+        else:
+            self.error('ERR invalid password')
+
+    def cmd_select(self, db):
+        self.db = int(db)
+        self.ok()
+
+    def cmd_get(self, key):
+        self.bulk(self._get(key))
+
+    def cmd_set(self, key, value, *flags):
+        flags = list(flags)
+        expires = None
+        if 'PX' in flags:
+            expires = time.time() + int(flags[flags.index('PX') + 1]) / 1000.
+        exists = self._get(key) is not None
+        if ('NX' in flags and exists) or ('XX' in flags and not exists):
+            self.bulk(None)
+            return
+        self.data[key] = (value, expires)
+        self.ok()
+
+    def cmd_del(self, *keys):
+        deleted = 0
+        for key in keys:
+            if self._get(key) is not None:
+                del self.data[key]
+                deleted += 1
+        self.integer(deleted)
+
+    def cmd_mget(self, *keys):
+        self.write('*%d\r\n' % len(keys))
+        for key in keys:
+            self.bulk(self._get(key))
+
+    def cmd_exists(self, key):
+        self.integer(self._get(key) is not None)
+
+    def cmd_incrby(self, key, delta):
+        value = self._get(key) or '0'
+        try:
+            value = int(value) + int(delta)
+        except ValueError:
+            self.error('ERR value is not an integer or out of range')
+            return
+        expires = self.data.get(key, (None, None))[1]
+        self.data[key] = (str(value), expires)
+        self.integer(value)
+
+    def cmd_eval(self, script, numkeys, *args):
+        # only the scripts django-redis runs for incr: INCRBY, guarded by
+        # an EXISTS check unless the script has none
+        key, delta = args[0], args[int(numkeys)]
+        if 'EXISTS' in script and self._get(key) is None:
+            self.bulk(None)
+        else:
+            self.cmd_incrby(key, delta)
+
+    def cmd_ttl(self, key):
+        if self._get(key) is None:
+            self.integer(-2)
+            return
+        expires = self.data[key][1]
+        self.integer(-1 if expires is None else int(expires - time.time()))
+
+    def cmd_scan(self, cursor, *options):
+        options = list(options)
+        pattern = '*'
+        if 'MATCH' in options:
+            pattern = options[options.index('MATCH') + 1]
+        keys = [key for key in list(self.data)
+                if self._get(key) is not None and
+                fnmatch.fnmatchcase(key, pattern)]
+        # everything in one pass
+        self.write('*2\r\n')
+        self.bulk('0')
+        self.write('*%d\r\n' % len(keys))
+        for key in keys:
+            self.bulk(key)
+
+
+class FakeRedisServer(SocketServer.ThreadingTCPServer):
+    """
+    A local stand-in for a Redis server, answering the commands
+    django-redis sends. Every command is recorded in
+    ``commands``; ``drop_connections`` closes the open client sockets.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, password=None):
+        SocketServer.ThreadingTCPServer.__init__(self, ('127.0.0.1', 0),
+                                                 FakeRedisHandler)
+        self.password = password
+        self.dbs = {}
+        self.commands = []
+        self.connections = 0
+        self.sockets = []
+        self.location = '127.0.0.1:%s' % self.server_address[1]
+        self.thread = threading.Thread(target=self.serve_forever,
+                                       args=(0.01,))
+        self.thread.daemon = True
+
+    def drop_connections(self):
+        for sock in self.sockets:
+            try:
+                sock.shutdown(2)
+                sock.close()
+            except Exception:
+                pass
+        self.sockets = []
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.drop_connections()
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,55 @@
+import fudge
+import requests
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from .. import github_api
+
+
+EMAIL_DATA = [
+    {u'verified': False, u'email': u'unverified@test.com',
+     u'primary': False},
+    {u'verified': True, u'email': u'verified@test.com', u'primary': False},
+    {u'verified': True, u'email': u'primary@test.com', u'primary': True},
+]
+
+
+class GithubApiTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_session_is_shared_and_pooled(self):
+        session = github_api.session()
+        self.assertIs(session, github_api.session())
+        adapter = session.get_adapter(github_api.EMAIL_URL)
+        self.assertEqual(github_api.RETRIES, adapter.max_retries)
+
+    @fudge.patch('codesy.github_api.session')
+    def test_get_has_timeout(self, fake_session):
+        (fake_session.expects_call().returns_fake()
+                     .expects('get')
+                     .with_args(github_api.EMAIL_URL,
+                                timeout=github_api.TIMEOUT))
+        github_api.get(github_api.EMAIL_URL)
+
+    @fudge.patch('codesy.github_api.get')
+    def test_verified_emails_are_cached_per_token(self, fake_get):
+        (fake_get.expects_call()
+                 .with_args(github_api.EMAIL_URL,
+                            params={'access_token': 'token1'})
+                 .times_called(1)
+                 .returns_fake()
+                 .provides('raise_for_status')
+                 .provides('json').returns(EMAIL_DATA))
+        for i in range(2):
+            self.assertEqual(['primary@test.com', 'verified@test.com'],
+                             github_api.verified_emails('token1'))
+
+    @fudge.patch('codesy.github_api.get')
+    def test_unreachable_github_is_not_cached(self, fake_get):
+        (fake_get.expects_call()
+                 .times_called(2)
+                 .raises(requests.Timeout('GitHub is slow')))
+        self.assertEqual([], github_api.verified_emails('token1'))
+        self.assertEqual([], github_api.verified_emails('token1'))
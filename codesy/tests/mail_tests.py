@@ -0,0 +1,133 @@
+from django.db import connection
+from django.test import TestCase, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from mailer.models import (RESULT_FAILURE, RESULT_SUCCESS, DontSendEntry,
+                           Message, MessageLog)
+
+from ..mail import MailWorker, send_mass_mail
+from .smtp_sink import SMTPSink
+
+
+class SendMassMailTest(TestCase):
+    def test_queues_all_messages_with_one_insert(self):
+        datatuple = [
+            ('subject %s' % i, 'body', 'from@test.com', ['%s@test.com' % i])
+            for i in range(5)
+        ]
+        # don't-send lookup, one INSERT
+        with self.assertNumQueries(2):
+            self.assertEqual(5, send_mass_mail(datatuple))
+        self.assertEqual(
+            sorted(['%s@test.com' % i for i in range(5)]),
+            sorted(m.to_addresses[0] for m in Message.objects.all())
+        )
+
+    def test_skips_dont_send_addresses(self):
+        DontSendEntry.objects.create(to_address='Blocked@test.com',
+                                     when_added=timezone.now())
+        send_mass_mail([
+            ('subject', 'body', 'from@test.com', ['blocked@test.com']),
+            ('subject', 'body', 'from@test.com',
+             ['blocked@test.com', 'ok@test.com']),
+        ])
+        self.assertEqual([['ok@test.com']],
+                         [m.to_addresses for m in Message.objects.all()])
+
+    def test_empty_batch_runs_no_queries(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(0, send_mass_mail([]))
+
+
+class MailWorkerTest(TestCase):
+    def queue(self, to, priority='medium'):
+        send_mass_mail([('to %s' % to, 'body', 'from@test.com', [to])],
+                       priority=priority)
+
+    def worker(self, sink, **kwargs):
+        kwargs.setdefault('sleep', lambda seconds: None)
+        return MailWorker(host='127.0.0.1', port=sink.port, use_tls=False,
+                          username='', password='', **kwargs)
+
+    def test_sends_queue_over_one_connection_most_urgent_first(self):
+        self.queue('low@test.com', 'low')
+        self.queue('medium@test.com')
+        self.queue('high@test.com', 'high')
+        with SMTPSink() as sink:
+            worker = self.worker(sink, batch_size=2)
+            worker.run(batches=2)
+        self.assertEqual(1, sink.connections)
+        self.assertEqual(
+            [['high@test.com'], ['medium@test.com'], ['low@test.com']],
+            [rcpttos for mailfrom, rcpttos, data in sink.messages])
+        self.assertFalse(Message.objects.exists())
+        self.assertEqual(3, MessageLog.objects.filter(
+            result=RESULT_SUCCESS).count())
+
+    def test_reconnects_when_the_connection_drops(self):
+        self.queue('one@test.com')
+        self.queue('two@test.com')
+        with SMTPSink() as sink:
+            worker = self.worker(sink, batch_size=1)
+            worker.send_batch()
+            worker.connection.connection.close()
+            worker.send_batch()
+        self.assertEqual(2, len(sink.messages))
+        self.assertEqual(2, sink.connections)
+
+    def test_refused_messages_are_deferred_and_retried_with_backoff(self):
+        now = [1000]
+        self.queue('refused@test.com')
+        self.queue('ok@test.com')
+        with SMTPSink(refuse=['refused@test.com']) as sink:
+            worker = self.worker(sink, retry_after=60,
+                                 clock=lambda: now[0])
+            worker.send_batch()
+            self.assertEqual(1, len(sink.messages))
+            self.assertEqual(1, Message.objects.deferred().count())
+            self.assertEqual(1, MessageLog.objects.filter(
+                result=RESULT_FAILURE).count())
+
+            self.assertEqual(0, worker.retry_deferred())
+            now[0] += 60
+            self.assertEqual(1, worker.retry_deferred())
+            worker.send_batch()
+            # failed again, so the next retry waits twice as long
+            now[0] += 60
+            self.assertEqual(1, worker.retry_deferred())
+            self.assertEqual(120, worker.retry_delay)
+
+    def test_leaves_queue_alone_when_server_is_down(self):
+        self.queue('one@test.com')
+        with SMTPSink() as sink:
+            port = sink.port
+        worker = MailWorker(host='127.0.0.1', port=port, use_tls=False,
+                            username='', password='')
+        self.assertEqual(0, worker.send_batch())
+        self.assertEqual(1, Message.objects.non_deferred().count())
+
+    @skipUnlessDBFeature('has_select_for_update')
+    def test_locks_the_batch_it_sends(self):
+        self.queue('one@test.com')
+        with SMTPSink() as sink:
+            with CaptureQueriesContext(connection) as queries:
+                self.worker(sink).send_batch()
+        selects = [q['sql'] for q in queries.captured_queries
+                   if 'FROM "mailer_message"' in q['sql'] and
+                   q['sql'].startswith('SELECT')]
+        self.assertIn('FOR UPDATE', selects[0])
+
+    def test_reports_metrics(self):
+        reports = []
+        self.queue('one@test.com')
+        self.queue('two@test.com')
+        with SMTPSink(refuse=['two@test.com']) as sink:
+            worker = self.worker(sink, report=reports.append)
+            worker.send_batch()
+            metrics = worker.report_metrics()
+        self.assertEqual(1, metrics['sent'])
+        self.assertEqual(1, metrics['deferred'])
+        self.assertEqual(0, metrics['queued'])
+        self.assertEqual(1, metrics['queued_deferred'])
+        self.assertIn('1 sent', reports[0])
@@ -1,3 +1,7 @@
+from StringIO import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
 from django.test import TestCase
 from django.test.client import RequestFactory
 
@@ -7,7 +11,8 @@ import fudge
 from model_mommy import mommy
 
 
-from ..base.models import EMAIL_URL, User, add_email_from_signup
+from ..base.models import User, add_email_from_signup_and_start_inactive
+from ..github_api import EMAIL_URL
 
 
 VERIFIED_PRIMARY_EMAIL = "verified+primary@test.com"
@@ -44,75 +49,72 @@ class SignUpReceiverTest(TestCase):
                      .has_attr(email=None)
                      .expects('save'))
         self.kwargs = {'sociallogin': self.sociallogin}
-        self.fake_get = fudge.Fake('requests.get')
+        cache.clear()
 
-    @fudge.patch('requests.get')
+    @fudge.patch('codesy.github_api.get')
     def test_verified_primary_email_from_github_api(self, fake_get):
         (fake_get.expects_call()
                  .with_args(EMAIL_URL, params=self.params)
                  .returns_fake()
+                 .provides('raise_for_status')
                  .expects('json')
                  .returns(
                      GITHUB_DATA_WITH_VERIFIED_PRIMARY_EMAIL))
 
-        add_email_from_signup(self.sender,
-                              self.request,
-                              self.user,
-                              **self.kwargs)
+        add_email_from_signup_and_start_inactive(self.sender,
+                                                 self.request,
+                                                 self.user,
+                                                 **self.kwargs)
         self.assertEquals(VERIFIED_PRIMARY_EMAIL, self.user.email)
 
-    @fudge.patch('requests.get')
+    @fudge.patch('codesy.github_api.get')
     def test_verified_email_from_github_api(self, fake_get):
         (fake_get.expects_call()
                  .with_args(EMAIL_URL, params=self.params)
                  .returns_fake()
+                 .provides('raise_for_status')
                  .expects('json')
                  .returns(
                      GITHUB_DATA_WITH_VERIFIED_EMAIL))
 
-        add_email_from_signup(self.sender,
-                              self.request,
-                              self.user,
-                              **self.kwargs)
+        add_email_from_signup_and_start_inactive(self.sender,
+                                                 self.request,
+                                                 self.user,
+                                                 **self.kwargs)
         self.assertEquals(VERIFIED_EMAIL, self.user.email)
 
-    @fudge.patch('requests.get')
+    @fudge.patch('codesy.github_api.get')
     def test_unverified_email_from_github_api(self, fake_get):
         (fake_get.expects_call()
                  .with_args(EMAIL_URL, params=self.params)
                  .returns_fake()
+                 .provides('raise_for_status')
                  .expects('json')
                  .returns(
                      GITHUB_DATA_WITH_UNVERIFIED_EMAIL))
 
-        add_email_from_signup(self.sender,
-                              self.request,
-                              self.user,
-                              **self.kwargs)
+        add_email_from_signup_and_start_inactive(self.sender,
+                                                 self.request,
+                                                 self.user,
+                                                 **self.kwargs)
         self.assertEquals(None, self.user.email)
 
-    @fudge.patch('requests.get')
+    @fudge.patch('codesy.github_api.get')
     def test_many_emails_from_github_api(self, fake_get):
         (fake_get.expects_call()
                  .with_args(EMAIL_URL, params=self.params)
                  .returns_fake()
+                 .provides('raise_for_status')
                  .expects('json')
                  .returns(
                      GITHUB_DATA_WITH_MANY_EMAILS))
 
-        add_email_from_signup(self.sender,
-                              self.request,
-                              self.user,
-                              **self.kwargs)
+        add_email_from_signup_and_start_inactive(self.sender,
+                                                 self.request,
+                                                 self.user,
+                                                 **self.kwargs)
         self.assertEquals(VERIFIED_PRIMARY_EMAIL, self.user.email)
 
-    @fudge.patch('stripe.Customer')
-    def test_save_cc_token(self, mock_stripe):
-        mock_stripe.provides('create').returns_fake().has_attr(id='dammit')
-        user = mommy.make(User)
-        user.stripe_account_token = "howdy"
-        user.save()
-
     def test_get_gravatar_url(self):
         user = mommy.make(User, email='fake@email.com')
         mommy.make(SocialAccount, user=user, uid="12345")
@@ -121,3 +123,97 @@ class SignUpReceiverTest(TestCase):
             user.get_gravatar_url(),
             'https://avatars3.githubusercontent.com/u/12345?v=3&s=96'
         )
+
+
+class AvatarTest(TestCase):
+    AVATAR = 'https://avatars3.githubusercontent.com/u/%s?v=3&s=96'
+
+    def setUp(self):
+        self.users = []
+        for uid in ('101', '102'):
+            user = mommy.make(User)
+            mommy.make(SocialAccount, user=user, provider='github', uid=uid)
+            self.users.append(user)
+
+    def test_account_save_stores_github_uid(self):
+        user = User.objects.get(pk=self.users[0].pk)
+        self.assertEqual('101', user.github_uid)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.AVATAR % '101', user.get_gravatar_url())
+
+    def test_prefetched_accounts_add_no_queries(self):
+        User.objects.update(github_uid='')
+        users = User.objects.filter(
+            pk__in=[u.pk for u in self.users]
+        ).order_by('pk').prefetch_related('socialaccount_set')
+        users = list(users)
+        with self.assertNumQueries(0):
+            self.assertEqual([self.AVATAR % '101', self.AVATAR % '102'],
+                             [user.get_gravatar_url() for user in users])
+
+    def test_backfill_github_uids(self):
+        User.objects.update(github_uid='')
+        out = StringIO()
+        call_command('backfill_github_uids', stdout=out)
+        self.assertEqual(['101', '102'],
+                         list(User.objects.filter(pk__in=[u.pk for u in
+                                                          self.users])
+                                          .order_by('pk')
+                                          .values_list('github_uid',
+                                                       flat=True)))
+        self.assertIn('2 users', out.getvalue())
+
+
+class StripeCustomerTest(TestCase):
+    def setUp(self):
+        self.user = mommy.make(User, email='user1@test.com')
+
+    def save_cc_token(self, token='tok_1'):
+        self.user.stripe_cc_token = token
+        self.user.save()
+        return User.objects.get(pk=self.user.pk)
+
+    @fudge.patch('stripe.Customer')
+    def test_save_cc_token_does_not_call_stripe(self, mock_stripe):
+        mock_stripe.provides('create').times_called(0)
+        user = self.save_cc_token()
+        self.assertTrue(user.stripe_pending)
+        self.assertEqual('', user.stripe_account_token)
+
+    @fudge.patch('stripe.Customer')
+    def test_provision_stripe_customer(self, mock_stripe):
+        keys = []
+        mock_stripe.provides('create').calls(
+            lambda **kwargs: keys.append(kwargs['idempotency_key']) or
+            fudge.Fake().has_attr(id='cus_1'))
+        user = self.save_cc_token()
+        self.assertTrue(user.provision_stripe_customer())
+        user = User.objects.get(pk=self.user.pk)
+        self.assertFalse(user.stripe_pending)
+        self.assertEqual('cus_1', user.stripe_account_token)
+
+        # a retry of the same token reuses the idempotency key
+        self.save_cc_token().provision_stripe_customer()
+        self.assertEqual(keys[0], keys[1])
+        self.save_cc_token('tok_2').provision_stripe_customer()
+        self.assertNotEqual(keys[0], keys[2])
+
+    @fudge.patch('stripe.Customer')
+    def test_provision_failure_records_error(self, mock_stripe):
+        mock_stripe.provides('create').raises(
+            Exception('Your card was declined.'))
+        user = self.save_cc_token()
+        self.assertFalse(user.provision_stripe_customer())
+        user = User.objects.get(pk=self.user.pk)
+        self.assertFalse(user.stripe_pending)
+        self.assertEqual('Your card was declined.', user.stripe_error)
+        self.assertEqual('', self.save_cc_token().stripe_error)
+
+    @fudge.patch('stripe.Customer')
+    def test_provision_keeps_newer_cc_token(self, mock_stripe):
+        mock_stripe.provides('create').returns_fake().has_attr(id='cus_1')
+        user = self.save_cc_token()
+        self.save_cc_token('tok_2')
+        user.provision_stripe_customer()
+        self.assertEqual('tok_2',
+                         User.objects.get(pk=self.user.pk).stripe_cc_token)
@@ -0,0 +1,48 @@
+import asyncore
+import smtpd
+import threading
+
+
+class _SinkServer(smtpd.SMTPServer):
+    def __init__(self, sink):
+        smtpd.SMTPServer.__init__(self, ('127.0.0.1', 0), None)
+        self.sink = sink
+
+    def handle_accept(self):
+        self.sink.connections += 1
+        smtpd.SMTPServer.handle_accept(self)
+
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        if set(rcpttos) & self.sink.refuse:
+            return '550 No such user'
+        self.sink.messages.append((mailfrom, rcpttos, data))
+
+
+class SMTPSink(object):
+    """
+    Local SMTP server that keeps what it receives, for testing mail
+    delivery over real connections.
+
+        with SMTPSink() as sink:
+            ... send to ('127.0.0.1', sink.port) ...
+            sink.messages  # [(mailfrom, rcpttos, data)]
+    """
+    def __init__(self, refuse=()):
+        self.refuse = set(refuse)
+        self.messages = []
+        self.connections = 0
+
+    def __enter__(self):
+        self.server = _SinkServer(self)
+        self.port = self.server.socket.getsockname()[1]
+        self.thread = threading.Thread(
+            target=asyncore.loop,
+            kwargs={'timeout': 0.01, 'map': asyncore.socket_map})
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.close()
+        asyncore.close_all()
+        self.thread.join()
@@ -67,8 +67,24 @@ function ShowSubmit(e) {
     $('.codesy_confirm').removeClass('hide')
 }
 
+function pollOfferStatus() {
+    var $status = $('p#offer-status[data-status-url]')
+    if (!$status.length) {
+        return
+    }
+    $.getJSON($status.data('status-url'), function(data) {
+        if (data.status === 'pending') {
+            setTimeout(pollOfferStatus, 2000)
+        } else {
+            // the reloaded widget shows the new bid and the final message
+            window.location.reload()
+        }
+    })
+}
+
 $(document).ready(function() {
   $('form.ajaxSubmit').submit(submitForm)
+  pollOfferStatus()
   $('button#ShowSubmit').click(ShowSubmit)
   $('button#cancelSubmit').click(reloadPlease)
 });